@@ -0,0 +1,305 @@
+"""
+Columnar export of session recordings (the NDJSON written by
+server/recorder.py) and vectorized queries over many sessions:
+
+    python sessions.py export XXX.ndjson YYY.ndjson --output study.npz
+    python sessions.py summary study.npz
+
+A session starts at every header record, so a recording appended to by a
+restarted server holds several sessions. The export is a NumPy .npz file
+with three tables of equal length columns:
+
+* moves, sorted by round and time -- session, room, round, round_id,
+  player, name, t, x, y, progress, delay and reset, True for the move which
+  exceeded the progress margin. session indexes the sessions table, name
+  indexes name_list and round_id the rounds table.
+* rounds -- round_session, round_room, round_index, round_start, round_end
+  (NaN if the round was not won) and round_points, the number of points of
+  both shapes (0 if not recorded).
+* sessions -- session_name, session_file and session_version, the recorder
+  version; resets are recorded since version 2.
+
+Queries work on whole columns, so they take about the same time for one
+session as for thousands of sessions' worth of moves.
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+
+MOVE_COLUMNS = {"session": np.int32, "room": np.int32, "round": np.int32,
+                "player": np.int8, "name": np.int32, "t": np.float64,
+                "x": np.float32, "y": np.float32, "progress": np.int32,
+                "delay": np.float32, "reset": np.bool_}
+RESET_VERSION = 2
+
+
+class SessionColumns(object):
+    """
+    SessionColumns holds the columns of exported sessions by name, see the
+    module docstring, and answers queries on them.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __len__(self):
+        return len(self.columns["t"])
+
+    @classmethod
+    def from_recordings(cls, paths):
+        sessions = []
+        names = {}
+        moves = {column: [] for column in MOVE_COLUMNS}
+        # (session, room, round) -> [start, end, points_a, points_b]
+        rounds = {}
+        last_move = {}
+        for path in paths:
+            with open(path) as f:
+                for line in f:
+                    record = json.loads(line)
+                    if "session" in record:
+                        sessions.append((record["session"], path,
+                                         record.get("version", 1)))
+                        continue
+                    if not sessions:
+                        sessions.append((os.path.basename(path), path, 1))
+                    session = len(sessions) - 1
+                    key = (session, record["room"], record["round"])
+                    if "player" in record:
+                        last_move[key[:2]] = len(moves["t"])
+                        for column, value in (
+                                ("session", session),
+                                ("room", record["room"]),
+                                ("round", record["round"]),
+                                ("player", record["player"]),
+                                ("name", names.setdefault(record["name"],
+                                                          len(names))),
+                                ("t", record["t"]), ("x", record["x"]),
+                                ("y", record["y"]),
+                                ("progress", record["progress"]),
+                                ("delay", record.get("delay", np.nan)),
+                                ("reset", False)):
+                            moves[column].append(value)
+                        continue
+                    info = rounds.setdefault(key, [np.nan, np.nan, 0, 0])
+                    if record["event"] == "start":
+                        info[0] = record["t"]
+                        info[2:] = record.get("points", (0, 0))
+                    elif record["event"] == "victory":
+                        info[1] = record["t"]
+                    elif (record["event"] == "reset"
+                            and key[:2] in last_move):
+                        moves["reset"][last_move[key[:2]]] = True
+
+        columns = {column: np.array(moves[column], dtype=dtype)
+                   for column, dtype in MOVE_COLUMNS.items()}
+        move_keys = np.stack([columns["session"], columns["room"],
+                              columns["round"]], axis=1).astype(np.int64)
+        event_keys = np.array(list(rounds), dtype=np.int64).reshape(-1, 3)
+        keys, inverse = np.unique(np.concatenate([move_keys, event_keys]),
+                                  axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        columns["round_id"] = inverse[:len(move_keys)].astype(np.int32)
+        order = np.lexsort((columns["t"], columns["round_id"]))
+        columns = {column: values[order] for column, values in columns.items()}
+
+        info = np.array(list(rounds.values()), dtype=np.float64).reshape(-1, 4)
+        event_rounds = inverse[len(move_keys):]
+        start = np.full(len(keys), np.nan)
+        end = np.full(len(keys), np.nan)
+        points = np.zeros((len(keys), 2), dtype=np.int32)
+        start[event_rounds] = info[:, 0]
+        end[event_rounds] = info[:, 1]
+        points[event_rounds] = info[:, 2:]
+        columns.update({
+            "round_session": keys[:, 0].astype(np.int32),
+            "round_room": keys[:, 1].astype(np.int32),
+            "round_index": keys[:, 2].astype(np.int32),
+            "round_start": start, "round_end": end, "round_points": points,
+            "session_name": np.array([s[0] for s in sessions], dtype=str),
+            "session_file": np.array([s[1] for s in sessions], dtype=str),
+            "session_version": np.array([s[2] for s in sessions],
+                                        dtype=np.int16),
+            "name_list": np.array(sorted(names, key=names.get), dtype=str)})
+        return cls(columns)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls({name: data[name] for name in data.files})
+
+    def save(self, path):
+        np.savez_compressed(path, **self.columns)
+
+    def round_starts(self):
+        """
+        Returns a mask of the first move of every round.
+        """
+        round_id = self["round_id"]
+        first = np.ones(len(round_id), dtype=bool)
+        first[1:] = round_id[1:] != round_id[:-1]
+        return first
+
+    def find_rounds(self, session=None, room=None, round_index=None):
+        """
+        Returns the ids of the rounds matching the given session name, room
+        and round index.
+        """
+        mask = np.ones(len(self["round_index"]), dtype=bool)
+        if session is not None:
+            sessions = np.flatnonzero(self["session_name"] == session)
+            mask &= np.isin(self["round_session"], sessions)
+        if room is not None:
+            mask &= self["round_room"] == room
+        if round_index is not None:
+            mask &= self["round_index"] == round_index
+        return np.flatnonzero(mask)
+
+    def trajectory(self, round_id, player):
+        """
+        Returns the t, x, y and progress columns of the moves of a player
+        in a round.
+        """
+        start, end = np.searchsorted(self["round_id"],
+                                     [round_id, round_id + 1])
+        mask = self["player"][start:end] == player
+        return tuple(self[column][start:end][mask]
+                     for column in ("t", "x", "y", "progress"))
+
+    def completion_times(self):
+        """
+        Returns the seconds from the start to the victory of every round,
+        NaN for rounds not won.
+        """
+        return self["round_end"] - self["round_start"]
+
+    def progress(self):
+        """
+        Returns the progress of both players after every move, as a
+        (moves, 2) array. A margin reset sets both players to 0.
+        """
+        player = self["player"]
+        reset = self["reset"]
+        index = np.arange(len(player))
+        first = np.maximum.accumulate(np.where(self.round_starts(), index, 0))
+        progress = np.zeros((len(player), 2), dtype=np.int32)
+        for player_id in (0, 1):
+            last = np.maximum.accumulate(
+                np.where((player == player_id) | reset, index, -1))
+            known = last >= first
+            last = np.maximum(last, 0)
+            progress[:, player_id] = np.where(
+                known & (player[last] == player_id),
+                self["progress"][last], 0)
+        return progress
+
+    def desync(self):
+        """
+        Returns the distance shown by the client after every move, the
+        difference of the players' relative progress. NaN for rounds whose
+        number of shape points was not recorded.
+        """
+        points = self["round_points"].astype(np.float64)
+        points[points == 0] = np.nan
+        points = points[self["round_id"]]
+        progress = self.progress()
+        return progress[:, 0] / points[:, 0] - progress[:, 1] / points[:, 1]
+
+    def round_desync(self):
+        """
+        Returns the mean and the maximum absolute desync of every round,
+        NaN for rounds without moves.
+        """
+        rounds = len(self["round_index"])
+        round_id = self["round_id"]
+        desync = np.abs(self.desync())
+        counts = np.bincount(round_id, minlength=rounds)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.bincount(round_id, weights=desync,
+                               minlength=rounds) / counts
+        maximum = np.full(rounds, np.nan)
+        starts = np.flatnonzero(self.round_starts())
+        if len(starts):
+            maximum[round_id[starts]] = np.maximum.reduceat(desync, starts)
+        return mean, maximum
+
+    def resets(self):
+        """
+        Returns the number of progress margin resets of every round, -1 for
+        sessions recorded before resets were.
+        """
+        counts = np.bincount(self["round_id"], weights=self["reset"],
+                             minlength=len(self["round_index"]))
+        known = (self["session_version"][self["round_session"]]
+                 >= RESET_VERSION)
+        return np.where(known, counts.astype(np.int64), -1)
+
+    def session_summary(self):
+        """
+        Returns {column: array over sessions} with the number of rounds and
+        won rounds, the mean completion time, mean absolute desync and
+        total resets of every session.
+        """
+        sessions = len(self["session_name"])
+        round_session = self["round_session"]
+        times = self.completion_times()
+        won = ~np.isnan(times)
+        mean_desync, _ = self.round_desync()
+        played = ~np.isnan(mean_desync)
+        resets = self.resets()
+
+        def total(weights, mask=None):
+            if mask is not None:
+                return np.bincount(round_session[mask], weights[mask],
+                                   minlength=sessions)
+            return np.bincount(round_session, weights, minlength=sessions)
+
+        rounds = np.bincount(round_session, minlength=sessions)
+        won_rounds = total(won.astype(np.float64))
+        played_rounds = total(played.astype(np.float64))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return {"rounds": rounds, "won": won_rounds.astype(np.int64),
+                    "completion_mean": total(times, won) / won_rounds,
+                    "desync_mean": (total(mean_desync, played)
+                                    / played_rounds),
+                    "resets": np.where(
+                        self["session_version"] >= RESET_VERSION,
+                        total(np.maximum(resets, 0).astype(np.float64)),
+                        np.nan)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="export recordings to .npz")
+    export.add_argument("recordings", nargs="+")
+    export.add_argument("--output", required=True)
+    summary = commands.add_parser("summary", help="print per session stats")
+    summary.add_argument("export")
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        columns = SessionColumns.from_recordings(args.recordings)
+        columns.save(args.output)
+        print("{0} sessions, {1} rounds, {2} moves".format(
+            len(columns["session_name"]), len(columns["round_index"]),
+            len(columns)))
+        return
+    columns = SessionColumns.load(args.export)
+    stats = columns.session_summary()
+    print("{0:<24} {1:>7} {2:>5} {3:>12} {4:>8} {5:>7}".format(
+        "session", "rounds", "won", "complete [s]", "desync", "resets"))
+    for index, name in enumerate(columns["session_name"]):
+        print("{0:<24} {1:>7} {2:>5} {3:>12.2f} {4:>8.3f} {5:>7.0f}".format(
+            name, stats["rounds"][index], stats["won"][index],
+            stats["completion_mean"][index], stats["desync_mean"][index],
+            stats["resets"][index]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Cost of the client's shape geometry updates for large shapes, comparing the
+former per-point transform with the vectorized one. With the geometry cache
+a state frame pays neither, only a resize does.
+
+    python render_bench.py [--points 10000]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+from common import shapes
+
+POS = (40., 80.)
+SIZE = (1536., 864.)
+
+
+def to_screen_lists(points, pos, size):
+    """
+    Former RootLayout.refresh_shapes loop.
+    """
+    line = []
+    for point in points:
+        line += (pos[0] + point[0] * size[0]), (pos[1] + point[1] * size[1])
+    return line
+
+
+def to_screen_vectorized(points, pos, size):
+    return shapes.to_screen(points, pos, size).ravel().tolist()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--points", type=int, default=10000)
+    parser.add_argument("--number", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    square = [[0.1, 0.1], [0.9, 0.1], [0.9, 0.9], [0.1, 0.9]]
+    points = shapes.interpolate_shape(square, 3.2 / args.points)
+    point_list = points.tolist()
+    print("{0} points".format(len(points)))
+    for name, function, data in (
+            ("per point", to_screen_lists, point_list),
+            ("vectorized", to_screen_vectorized, points)):
+        seconds = min(timeit.repeat(lambda: function(data, POS, SIZE),
+                                    number=args.number, repeat=3))
+        print("{0:>12}: {1:8.3f} ms per shape".format(
+            name, 1000. * seconds / args.number))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Construction time and memory of interpolated shapes, comparing the array
+based common/shapes.py with the list of tuples built by the former
+GameState.interpolate_shape.
+
+    python shapes_bench.py [--shapes-file ../server/shape_library.json]
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+from common import shapes
+
+# Point counts between 10^3 and 10^6 for shapes with perimeter around 1-3.
+DENSITIES = (1e-3, 1e-4, 1e-5, 1e-6)
+
+
+def interpolate_shape_lists(verts, density):
+    """
+    Point by point interpolation into a list of tuples, as done before the
+    shapes module.
+    """
+    points = []
+    for i in range(len(verts)):
+        cv, nv = verts[i], verts[(i+1) % len(verts)]
+        points.append(cv)
+        split_number = math.floor(math.hypot(nv[0] - cv[0], nv[1] - cv[1])
+                                  / density)
+        if split_number == 0:
+            continue
+        x, y = cv
+        x_delta = (nv[0] - cv[0]) / split_number
+        y_delta = (nv[1] - cv[1]) / split_number
+        for _ in range(split_number):
+            x += x_delta
+            y += y_delta
+            points.append((x, y))
+    return points
+
+
+def measure(function, verts, density, repeat):
+    tracemalloc.start()
+    points = function(verts, density)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    seconds = min(timeit.repeat(lambda: function(verts, density),
+                                number=1, repeat=repeat))
+    return len(points), seconds, memory
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--shapes-file", default=os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), os.pardir, "server",
+        "shape_library.json"))
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    with open(args.shapes_file) as f:
+        verts = json.load(f)[-1][0]
+
+    print("{0:>8} {1:>9} {2:>12} {3:>12} {4:>12} {5:>12}".format(
+        "density", "points", "lists [s]", "array [s]", "lists [MB]",
+        "array [MB]"))
+    for density in DENSITIES:
+        n, list_time, list_memory = measure(interpolate_shape_lists, verts,
+                                            density, args.repeat)
+        _, array_time, array_memory = measure(shapes.interpolate_shape,
+                                              verts, density, args.repeat)
+        print("{0:>8g} {1:>9d} {2:>12.4f} {3:>12.4f} {4:>12.1f} "
+              "{5:>12.1f}".format(density, n, list_time, array_time,
+                                  list_memory / 1e6, array_memory / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+"""
+Compares the Twisted and the asyncio networking stacks on loopback. Both
+servers (server/headless.py, server/aio_server.py) are driven by closed loop
+clients of both stacks (loadtest/botclient.py, client/aio_client.py): every
+client sends its next move as soon as the server echoes its previous one,
+so moves per second and the move round trip measure the stack overhead.
+
+    python stack_bench.py --pairs 20 --duration 5 [--output stacks.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+for directory in ("client", "loadtest", "shape_generator"):
+    sys.path.insert(0, os.path.join(ROOT, directory))
+
+from common import codec
+
+SERVERS = {"twisted": os.path.join(ROOT, "server", "headless.py"),
+           "asyncio": os.path.join(ROOT, "server", "aio_server.py")}
+CLIENTS = ("twisted", "asyncio")
+
+
+class ClosedLoop(object):
+    """
+    Stack independent client logic: trace the own shape one point per move,
+    sending the next move when the previous one is echoed. Echoes are
+    recognized by the move seq of the time feature, so progress resets
+    caused by the partner do not count.
+    """
+
+    def __init__(self, latencies):
+        self.latencies = latencies
+        self.player_id = None
+        self.shape = None
+        self.progress = 0
+        self.seq = 0
+        self.sent_at = None
+
+    def round_started(self, shape):
+        self.shape = shape
+        self.progress = 0
+        self.move()
+
+    def echoed(self, seq, progress):
+        self.progress = progress
+        if self.sent_at is None or seq != self.seq:
+            return
+        self.latencies.append(time.perf_counter() - self.sent_at)
+        self.move()
+
+    def round_finished(self):
+        self.sent_at = None
+
+    def move(self):
+        self.seq += 1
+        self.sent_at = time.perf_counter()
+        self.send(self.shape[min(self.progress, len(self.shape) - 1)])
+
+    def encode_move(self, pos, features):
+        return codec.encode_move(pos, codec.QUANT in features, self.seq,
+                                 time.time())
+
+
+class AsyncioApp(ClosedLoop):
+
+    def __init__(self, latencies):
+        super(AsyncioApp, self).__init__(latencies)
+        self.protocol = None
+
+    def send(self, pos):
+        self.protocol.send_line(self.encode_move(pos,
+                                                 self.protocol.features))
+
+    def on_connection(self, protocol):
+        self.protocol = protocol
+        protocol.set_ready()
+
+    def on_game_start(self, two_player_game, player_id):
+        self.player_id = player_id
+
+    def update_game(self, state):
+        if "shapes" in state:
+            self.round_started(state["shapes"][self.player_id])
+
+    def update_player(self, player_id, pos, progress, seq, sent):
+        if player_id == self.player_id:
+            self.echoed(seq, progress)
+
+    def on_reset(self):
+        self.round_finished()
+        self.protocol.set_ready()
+
+    def on_finished(self):
+        self.protocol.transport.close()
+
+    def on_connection_lost(self):
+        pass
+
+
+def run_asyncio_clients(port, pairs, duration):
+    from aio_client import AsyncGameClientProtocol
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        latencies = []
+        connections = []
+        for index in range(2 * pairs):
+            app = AsyncioApp(latencies)
+            connections.append(await loop.create_connection(
+                lambda: AsyncGameClientProtocol(
+                    app, "bench-{0:04d}".format(index)),
+                "localhost", port))
+        await asyncio.sleep(duration)
+        for transport, _ in connections:
+            transport.close()
+        return latencies
+    return asyncio.run(run())
+
+
+def run_twisted_clients(port, pairs, duration):
+    from twisted.internet import reactor
+    from botclient import BotFactory, BotProtocol, BotStats
+
+    latencies = []
+
+    class TwistedBot(BotProtocol, ClosedLoop):
+
+        def __init__(self, name):
+            BotProtocol.__init__(self, name, BotStats())
+            ClosedLoop.__init__(self, latencies)
+
+        def send(self, pos):
+            self.sendLine(self.encode_move(pos, self.features))
+
+        def lineReceived(self, line):
+            if line[:2] != codec.PLAYER.encode("ascii"):
+                return BotProtocol.lineReceived(self, line)
+            player_id, _, progress, seq, _ = codec.decode_player(
+                line.decode("utf-8"))
+            if player_id == self.player_id:
+                self.echoed(seq, progress)
+
+        def round_started(self):
+            ClosedLoop.round_started(self, self.shapes[self.player_id])
+
+        def round_finished(self):
+            ClosedLoop.round_finished(self)
+
+        def update_players(self, players):
+            pass
+
+    for index in range(2 * pairs):
+        name = "bench-{0:04d}".format(index)
+        reactor.connectTCP("localhost", port,
+                           BotFactory(lambda name=name: TwistedBot(name)))
+    reactor.callLater(duration, reactor.stop)
+    reactor.run()
+    return latencies
+
+
+def client_main(args):
+    run = {"asyncio": run_asyncio_clients,
+           "twisted": run_twisted_clients}[args.client]
+    started = time.time()
+    latencies = run(args.port, args.pairs, args.duration)
+    elapsed = time.time() - started
+    result = {"moves": len(latencies),
+              "moves_per_s": len(latencies) / elapsed,
+              "moves_per_s_per_connection": (len(latencies) / elapsed
+                                             / (2 * args.pairs))}
+    if latencies:
+        latencies = np.array(latencies) * 1000.
+        for q in (50, 90, 99):
+            result["latency_p{0}_ms".format(q)] = float(
+                np.percentile(latencies, q))
+    print(json.dumps(result))
+
+
+def wait_for_port(port, timeout=10.):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("localhost", port), 0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("server on port {0} did not start".format(port))
+
+
+def write_library(path, rounds):
+    from shape_generator import generateLibrary
+    library = generateLibrary(rounds, twoPlayer=True, sameShape=False,
+                              processes=1, seed=0, aveRadius=0.3,
+                              irregularity=0.5, spikeyness=0.2, numVerts=12)
+    with open(path, "w") as f:
+        f.write(json.dumps(library))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--pairs", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=5.)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--rounds", type=int, default=1000)
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--client", choices=CLIENTS, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.client:
+        client_main(args)
+        return
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        shapes_file = os.path.join(directory, "library.json")
+        write_library(shapes_file, args.rounds)
+        for server_stack, script in sorted(SERVERS.items()):
+            for client_stack in CLIENTS:
+                server = subprocess.Popen(
+                    [sys.executable, script, "--port", str(args.port),
+                     "--session", os.path.join(directory, server_stack),
+                     "--shapes-file", shapes_file, "--stats-interval", "0",
+                     "--ping-interval", "0", "--journal-interval", "0"])
+                try:
+                    wait_for_port(args.port)
+                    output = subprocess.check_output(
+                        [sys.executable, os.path.abspath(__file__),
+                         "--client", client_stack, "--port", str(args.port),
+                         "--pairs", str(args.pairs),
+                         "--duration", str(args.duration)])
+                finally:
+                    server.terminate()
+                    server.wait()
+                name = "server={0}/client={1}".format(server_stack,
+                                                      client_stack)
+                results[name] = json.loads(output.decode("utf-8"))
+                print("{0:<36} {1:>10.0f} moves/s {2:>8.3f} ms p50 "
+                      "{3:>8.3f} ms p99".format(
+                          name, results[name]["moves_per_s"],
+                          results[name].get("latency_p50_ms", 0),
+                          results[name].get("latency_p99_ms", 0)))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"pairs": args.pairs, "duration": args.duration,
+                       "results": results}, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,403 @@
+"""
+Benchmark suite for the game logic, the protocol and the shape generator.
+Results are written as JSON, so runs on different commits can be compared:
+
+    python suite.py --output before.json
+    python suite.py --output after.json
+    python suite.py --compare before.json after.json
+
+Every case reports the best per-call time of several repeats, cases are
+identified by name so --compare matches them across files. --only runs the
+cases whose name starts with any of the given prefixes.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+for directory in ("server", "shape_generator", "analysis"):
+    sys.path.insert(0, os.path.join(ROOT, directory))
+
+from twisted.internet.testing import StringTransport
+from twisted.protocols.basic import LineReceiver
+
+from common import codec, shapes
+from game_server import GameServerFactory, GameServerProtocol
+from common.game_state import GameState
+from library import JsonLibrary
+from logger import Logger
+from sessions import RESET_VERSION, SessionColumns
+from shape_generator import generatePolygon, generatePolygons
+
+VERTS = (10, 50, 200)
+DENSITIES = (1e-2, 1e-3, 1e-4)
+
+
+def best(function, number, repeat):
+    """
+    Best seconds per call of function over repeat runs of number calls.
+    """
+    return min(timeit.repeat(function, number=number,
+                             repeat=repeat)) / number
+
+
+def polygon(num_verts, seed=0):
+    return generatePolygons(1, 0.3, 0.5, 0.2, num_verts, rng=seed)[0]
+
+
+def bench_interpolate(repeat):
+    for num_verts in VERTS:
+        verts = polygon(num_verts)
+        for density in DENSITIES:
+            points = shapes.interpolate_shape(verts, density)
+            number = max(1, int(2e5 / len(points)))
+            yield ("interpolate/verts={0}/density={1:g}".format(
+                num_verts, density),
+                {"points": len(points),
+                 "seconds": best(lambda: shapes.interpolate_shape(verts,
+                                                                  density),
+                                 number, repeat)})
+
+
+def bench_update(repeat):
+    """
+    A player tracing its shape point by point, one update per point.
+    """
+    for num_verts in VERTS:
+        verts = polygon(num_verts)
+        for density in DENSITIES[:2]:
+            points = shapes.interpolate_shape(verts, density)
+            moves = points.tolist()
+            for sweep in (False, True):
+                def trace():
+                    state = GameState.from_points(points, points, False,
+                                                  sweep)
+                    for move in moves:
+                        state.update(0, move)
+                seconds = best(trace, 1, repeat)
+                yield ("update/{0}/verts={1}/density={2:g}".format(
+                    "sweep" if sweep else "next", num_verts, density),
+                    {"points": len(points), "moves": len(moves),
+                     "seconds": seconds / len(moves)})
+
+
+class ChunkSink(object):
+    """
+    Stands in for a line mode GameServerProtocol, keeping the chunked
+    lines.
+    """
+    MAX_LENGTH = GameServerProtocol.MAX_LENGTH
+    features = ()
+
+    def __init__(self):
+        self.lines = []
+
+    def sendLine(self, line):
+        self.lines.append(line)
+        return len(line) + 2
+
+
+def bench_protocol(repeat):
+    for density in DENSITIES[:2]:
+        game_state = {"shapes": [shapes.interpolate_shape(polygon(50, seed),
+                                                          density).tolist()
+                                 for seed in (0, 1)],
+                      "players": [[[0.5, 0.5], 0], [[0.5, 0.5], 0]]}
+        sink = ChunkSink()
+
+        def encode():
+            sink.lines = []
+            GameServerProtocol.send_game_state(sink, game_state)
+        encode()
+        lines = sink.lines[:-1]
+        data = json.dumps(game_state).encode("utf-8")
+        wires = {"decode": b"".join(line.encode("utf-8") + b"\r\n"
+                                    for line in sink.lines),
+                 "decode_frame": (codec.encode_frame_header(
+                     len(data)).encode("ascii") + b"\r\n" + data)}
+
+        def receive(wire):
+            # the receive path of GameClientProtocol, data arriving in
+            # socket sized chunks
+            chunks = [wire[i:i + 65536] for i in range(0, len(wire), 65536)]
+
+            def decode():
+                bot = LoopbackBot("bench")
+                bot.player_id = 0
+                for chunk in chunks:
+                    bot.dataReceived(chunk)
+                return bot.shape
+            return decode
+        name = "protocol/game_state/density={0:g}".format(density)
+        yield (name + "/encode", {"lines": len(sink.lines),
+                                  "chars": sum(map(len, lines)),
+                                  "seconds": best(encode, 10, repeat)})
+        for case, wire in sorted(wires.items()):
+            decode = receive(wire)
+            assert decode() == game_state["shapes"][0]
+            yield (name + "/" + case, {"seconds": best(decode, 10, repeat)})
+
+    player = [[0.123456, 0.654321], 42]
+    line = codec.encode_player(1, player, 7, time.time())
+    yield ("protocol/player/encode",
+           {"seconds": best(lambda: codec.encode_player(1, player, 7, 1e9),
+                            10000, repeat)})
+    yield ("protocol/player/decode",
+           {"seconds": best(lambda: codec.decode_player(line), 10000,
+                            repeat)})
+    for quantized in (False, True):
+        move = codec.encode_move((0.123456789, 0.987654321), quantized)
+        yield ("protocol/move/{0}/decode".format(
+            "quant" if quantized else "float"),
+            {"seconds": best(lambda: codec.decode_move(move), 10000,
+                             repeat)})
+
+
+def bench_generator(repeat):
+    yield ("generator/generatePolygon",
+           {"seconds": best(lambda: generatePolygon(0.3, 0.5, 0.2, 50), 100,
+                            repeat)})
+    count = 10000
+    yield ("generator/generatePolygons/count={0}".format(count),
+           {"seconds": best(lambda: generatePolygons(count, 0.3, 0.5, 0.2,
+                                                     50, rng=0),
+                            1, repeat) / count})
+
+
+class LoopbackBot(LineReceiver):
+    """
+    Client side of an in-process round: traces its shape one point per move
+    and parses frames like GameClientProtocol.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.msg_buffer = []
+        self.frame = None
+        self.shape = None
+        self.player_id = None
+        self.progress = 0
+        self.finished = False
+
+    def lineReceived(self, line):
+        line = line.decode("utf-8")
+        if line[:5] == codec.PROTO:
+            return
+        if line[:5] == "start":
+            self.player_id = int(line[8])
+        elif line == "reset":
+            self.finished = True
+        elif line[:2] == codec.PLAYER:
+            player_id, _, progress, _, _ = codec.decode_player(line)
+            if player_id == self.player_id:
+                self.progress = progress
+        elif line[:6] == codec.FRAME + " ":
+            self.frame = codec.FrameReader(codec.decode_frame_header(line))
+            self.setRawMode()
+        elif line == "json_end":
+            self.update_game(json.loads("".join(self.msg_buffer)))
+            self.msg_buffer = []
+        else:
+            self.msg_buffer.append(line)
+
+    def rawDataReceived(self, data):
+        rest = self.frame.feed(data)
+        if rest is None:
+            return
+        self.update_game(self.frame.decode())
+        self.frame = None
+        self.setLineMode(rest)
+
+    def update_game(self, state):
+        if "shapes" in state:
+            self.shape = state["shapes"][self.player_id]
+
+    def move(self):
+        point = self.shape[min(self.progress, len(self.shape) - 1)]
+        self.sendLine(codec.encode_move(point, True).encode("utf-8"))
+
+
+def pump(pairs):
+    """
+    Moves pending bytes between the transports of (server, client) pairs
+    until none are left.
+    """
+    moved = True
+    while moved:
+        moved = False
+        for server, client in pairs:
+            for source, target in ((server, client), (client, server)):
+                data = source.transport.value()
+                if data:
+                    source.transport.clear()
+                    target.dataReceived(data)
+                    moved = True
+
+
+def bench_round(repeat):
+    """
+    A full two player round against the real server protocol, over
+    in-memory transports, both bots alternating moves.
+    """
+    verts = polygon(50).tolist()
+    log = tempfile.NamedTemporaryFile(suffix=".txt", delete=False)
+    log.close()
+    logger = Logger(log.name)
+    library = JsonLibrary([(verts, verts, True)] * (repeat + 1))
+    factory = GameServerFactory(library, logger, stats_interval=0,
+                                ping_interval=0)
+    pairs = []
+    for name in ("bot-a", "bot-b"):
+        server = factory.buildProtocol(None)
+        server.makeConnection(StringTransport())
+        client = LoopbackBot(name)
+        client.makeConnection(StringTransport())
+        pairs.append((server, client))
+
+    bots = [client for _, client in pairs]
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        moves = 0
+        for bot in bots:
+            bot.finished = False
+            bot.progress = 0
+            bot.sendLine(codec.encode_proto((codec.DELTA, codec.QUANT,
+                                             codec.FRAME)).encode("utf-8"))
+            bot.sendLine("ready {0}".format(bot.name).encode("utf-8"))
+            pump(pairs)
+        while not all(bot.finished for bot in bots):
+            for bot in bots:
+                bot.move()
+                moves += 1
+            pump(pairs)
+        timings.append((time.perf_counter() - start, moves))
+    factory.stop()
+    logger.stop()
+    os.unlink(log.name)
+
+    seconds, moves = min(timings)
+    yield ("round/loopback", {"moves": moves, "seconds": seconds,
+                              "moves_per_s": moves / seconds})
+
+
+def synthetic_sessions(sessions, rounds, moves, seed=0):
+    """
+    Exported sessions with rounds of moves alternating between players,
+    progress growing with occasional margin resets.
+    """
+    rng = np.random.default_rng(seed)
+    count = sessions * rounds
+    round_id = np.repeat(np.arange(count, dtype=np.int32), moves)
+    step = np.tile(np.arange(moves), count)
+    reset = rng.random(len(round_id)) < 1e-3
+    start = np.arange(count) * 60.
+    return SessionColumns({
+        "round_id": round_id, "session": round_id // rounds,
+        "player": (step % 2).astype(np.int8),
+        "t": start[round_id] + step * 0.05,
+        "progress": np.where(reset, 0, step // 2).astype(np.int32),
+        "reset": reset,
+        "round_session": (np.arange(count) // rounds).astype(np.int32),
+        "round_index": (np.arange(count) % rounds).astype(np.int32),
+        "round_start": start, "round_end": start + moves * 0.05,
+        "round_points": np.full((count, 2), moves // 2, dtype=np.int32),
+        "session_name": np.array(["s{0}".format(i)
+                                  for i in range(sessions)]),
+        "session_version": np.full(sessions, RESET_VERSION,
+                                   dtype=np.int16)})
+
+
+def bench_analysis(repeat):
+    """
+    Queries over the moves of 1000 sessions of 10 rounds.
+    """
+    columns = synthetic_sessions(1000, 10, 200)
+    for name, query in (("completion", columns.completion_times),
+                        ("desync", columns.round_desync),
+                        ("resets", columns.resets),
+                        ("summary", columns.session_summary)):
+        yield ("analysis/{0}".format(name),
+               {"moves": len(columns),
+                "seconds": best(query, 1, repeat)})
+
+
+BENCHMARKS = (bench_interpolate, bench_update, bench_protocol,
+              bench_generator, bench_round, bench_analysis)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+            stderr=subprocess.DEVNULL).decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(repeat, only=()):
+    results = {}
+    for benchmark in BENCHMARKS:
+        family = benchmark.__name__[len("bench_"):]
+        if only and not any(family.startswith(prefix.split("/")[0])
+                            for prefix in only):
+            continue
+        for name, result in benchmark(repeat):
+            if only and not name.startswith(tuple(only)):
+                continue
+            results[name] = result
+            print("{0:<48} {1:>12.3f} us".format(name,
+                                                1e6 * result["seconds"]))
+    return {"commit": git_commit(), "time": time.time(),
+            "python": platform.python_version(), "numpy": np.__version__,
+            "machine": platform.machine(), "repeat": repeat,
+            "results": results}
+
+
+def compare(before_file, after_file):
+    with open(before_file) as f:
+        before = json.load(f)
+    with open(after_file) as f:
+        after = json.load(f)
+    print("{0:<48} {1:>12} {2:>12} {3:>8}".format(
+        "case ({0} -> {1})".format(before["commit"], after["commit"]),
+        "before [us]", "after [us]", "ratio"))
+    for name, result in sorted(after["results"].items()):
+        if name not in before["results"]:
+            continue
+        old = before["results"][name]["seconds"]
+        new = result["seconds"]
+        print("{0:<48} {1:>12.3f} {2:>12.3f} {3:>8.2f}".format(
+            name, 1e6 * old, 1e6 * new, new / old if old else float("nan")))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", nargs="*", default=(),
+                        help="run only cases starting with these prefixes")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"),
+                        help="compare two result files instead of running")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    report = run(args.repeat, args.only)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
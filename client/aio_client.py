@@ -0,0 +1,152 @@
+"""
+Game client protocol on asyncio, without Kivy or Twisted, for headless
+clients such as bots and benchmarks. It follows GameClientProtocol message
+by message and reports to an app object with these methods:
+
+    on_connection(protocol)
+    on_game_start(two_player_game, player_id)
+    update_game(state)             -- JSON game state, chunked or framed
+    update_player(player_id, pos, progress, seq, sent)
+    on_reset()                     -- round won, call set_ready to go on
+    on_finished()                  -- shape library exhausted
+    on_connection_lost()
+
+    loop.create_connection(lambda: AsyncGameClientProtocol(app, name),
+                           host, port)
+"""
+import asyncio
+import json
+import time
+
+from common import codec
+from common.timesync import ClockSync
+
+
+class AsyncGameClientProtocol(asyncio.Protocol):
+    """
+    Client side of the game protocol. Lines end with "\\r\\n" as in
+    LineReceiver; a frame header switches to collecting the frame body.
+    """
+    delimiter = b"\r\n"
+    PING_INTERVAL = 2.
+
+    def __init__(self, app, name, features=codec.FEATURES):
+        self.app = app
+        self.name = name
+        self.requested_features = features
+        self.features = set()
+        self.state = "WAIT"
+        self.transport = None
+        self.buffer = b""
+        self.msg_buffer = []
+        self.frame = None
+        self.sync = ClockSync()
+        self.move_seq = 0
+        self.ping_timer = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.app.on_connection(self)
+
+    def data_received(self, data):
+        if self.frame is not None:
+            data = self.frame_received(data)
+            if data is None:
+                return
+        data = self.buffer + data
+        start = 0
+        while self.frame is None:
+            end = data.find(self.delimiter, start)
+            if end < 0:
+                break
+            line = data[start:end]
+            start = end + len(self.delimiter)
+            self.line_received(line.decode("utf-8"))
+        self.buffer = b""
+        if self.frame is not None:
+            if start < len(data):
+                self.data_received(data[start:])
+        else:
+            self.buffer = data[start:]
+
+    def frame_received(self, data):
+        """
+        Collects a frame body, returns the data following it once complete.
+        """
+        rest = self.frame.feed(data)
+        if rest is None:
+            return None
+        state = self.frame.decode()
+        self.frame = None
+        self.app.update_game(state)
+        return rest
+
+    def line_received(self, line):
+        if line[:5] == codec.PROTO:
+            self.features = codec.decode_proto(line)
+            if codec.TIME in self.features and self.ping_timer is None:
+                self.send_ping()
+        elif line[:4] == codec.PING:
+            self.send_line(codec.encode_pong(line, time.time()))
+        elif line[:4] == codec.PONG:
+            _, sent, remote = codec.decode_pong(line)
+            self.sync.pong(sent, remote, time.time())
+        elif self.state == "READY":
+            if line[:5] == "start":
+                self.state = "GAME"
+                self.app.on_game_start(bool(int(line[6])), int(line[8]))
+            elif line == "finish":
+                self.state = "FINISHED"
+                self.app.on_finished()
+        elif self.state == "GAME":
+            if line == "reset":
+                self.state = "WAIT"
+                self.app.on_reset()
+            elif line[:2] == codec.PLAYER:
+                self.app.update_player(*codec.decode_player(line))
+            elif line[:6] == codec.FRAME + " ":
+                self.frame = codec.FrameReader(codec.decode_frame_header(line))
+            elif line == "json_end":
+                state = json.loads("".join(self.msg_buffer))
+                self.msg_buffer = []
+                self.app.update_game(state)
+            else:
+                self.msg_buffer.append(line)
+
+    def send_line(self, line):
+        self.transport.write(line.encode("utf-8") + self.delimiter)
+
+    def send_ping(self):
+        self.send_line(codec.encode_ping(self.sync.next_seq(), time.time()))
+        self.ping_timer = asyncio.get_running_loop().call_later(
+            self.PING_INTERVAL, self.send_ping)
+
+    def send_player_position(self, pos):
+        """
+        Sends a move, returns its sequence number when the time feature is
+        used, otherwise None.
+        """
+        seq = sent = None
+        if codec.TIME in self.features:
+            self.move_seq += 1
+            seq, sent = self.move_seq, self.sync.remote_time(time.time())
+        self.send_line(codec.encode_move(pos, codec.QUANT in self.features,
+                                         seq, sent))
+        return seq
+
+    def set_ready(self, shapes_hash=None):
+        """
+        Reports ready, with the shapes_hash of the cached shapes to rejoin a
+        round after a reconnect.
+        """
+        self.state = "READY"
+        if self.requested_features:
+            self.send_line(codec.encode_proto(self.requested_features))
+        if shapes_hash is not None:
+            self.send_line(codec.encode_have(shapes_hash))
+        self.send_line("ready {0}".format(self.name))
+
+    def connection_lost(self, exc):
+        if self.ping_timer is not None:
+            self.ping_timer.cancel()
+        self.app.on_connection_lost()
@@ -1,6 +1,8 @@
 import json
+import time
 
 from kivy.app import App
+from kivy.logger import Logger as KivyLogger
 from kivy.uix.popup import Popup
 from kivy.uix.label import Label
 from kivy.uix.boxlayout import BoxLayout
@@ -14,10 +16,19 @@ if 'twisted.internet.reactor' in sys.modules:
     del sys.modules['twisted.internet.reactor']
 install_twisted_reactor()
 
+import os
+# the repository root, holding the shared common package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
 from twisted.internet import reactor
 from twisted.internet.protocol import ClientFactory
 from twisted.protocols.basic import LineReceiver
 
+from common import codec, shapes
+from common.game_state import GameState
+from common.timesync import ClockSync
+
 
 class GameClientProtocol(LineReceiver):
     """
@@ -27,14 +38,29 @@ class GameClientProtocol(LineReceiver):
     def __init__(self, factory):
         self.factory = factory
         self.state = "WAIT"
-        self.msg_buffer = ""
+        self.msg_buffer = []
+        self.frame = None
+        self.features = set()
+        self.sync = ClockSync()
+        self.move_seq = 0
 
     def connectionMade(self):
         self.factory.app.on_connection(self)
 
     def lineReceived(self, line):
         line = line.decode('utf-8')
-        if self.state == "READY":
+        if line[:5] == codec.PROTO:
+            self.features = codec.decode_proto(line)
+            Clock.unschedule(self.send_ping)
+            if codec.TIME in self.features:
+                self.send_ping()
+                Clock.schedule_interval(self.send_ping, 2.)
+        elif line[:4] == codec.PING:
+            self.sendLine(codec.encode_pong(line, time.time()))
+        elif line[:4] == codec.PONG:
+            _, sent, remote = codec.decode_pong(line)
+            self.sync.pong(sent, remote, time.time())
+        elif self.state == "READY":
             if line[:5] == "start":
                 self.factory.app.root.two_player_game = bool(int(line[6]))
                 self.factory.app.root.player_id = line[8]
@@ -44,21 +70,67 @@ class GameClientProtocol(LineReceiver):
         elif self.state == "GAME":
             if line == "reset":
                 self.set_wait()
+            elif line[:2] == codec.PLAYER:
+                self.factory.app.update_player(*codec.decode_player(line))
+            elif line[:6] == codec.FRAME + " ":
+                self.frame = codec.FrameReader(codec.decode_frame_header(line))
+                self.setRawMode()
             elif line == "json_end":
-                state = json.loads(self.msg_buffer)
-                self.msg_buffer = ""
+                state = json.loads("".join(self.msg_buffer))
+                self.msg_buffer = []
                 self.factory.app.update_game(state)
             else:
-                self.msg_buffer += line
+                self.msg_buffer.append(line)
+
+    def rawDataReceived(self, data):
+        """
+        Collects a frame body, see codec.FRAME.
+        """
+        rest = self.frame.feed(data)
+        if rest is None:
+            return
+        state = self.frame.decode()
+        self.frame = None
+        self.factory.app.update_game(state)
+        self.setLineMode(rest)
 
     def sendLine(self, line):
         LineReceiver.sendLine(self, line.encode('utf-8'))
 
-    def send_player_position(self, pos):
-        self.sendLine("{0},{1}".format(*pos))
+    def connectionLost(self, reason):
+        Clock.unschedule(self.send_ping)
+
+    def send_ping(self, *args):
+        self.sendLine(codec.encode_ping(self.sync.next_seq(), time.time()))
 
-    def set_ready(self):
+    def send_player_position(self, pos):
+        """
+        Sends a move, returns its sequence number when the time feature is
+        used, otherwise None.
+        """
+        seq = sent = None
+        if codec.TIME in self.features:
+            self.move_seq += 1
+            seq, sent = self.move_seq, self.sync.remote_time(time.time())
+        self.sendLine(codec.encode_move(pos, codec.QUANT in self.features,
+                                        seq, sent))
+        return seq
+
+    def can_predict(self):
+        """
+        Prediction needs the seq of the last applied move in player deltas.
+        """
+        return codec.DELTA in self.features and codec.TIME in self.features
+
+    def set_ready(self, shapes_hash=None):
+        """
+        Reports ready, with the shapes_hash of the cached shapes when
+        rejoining a round after a reconnect.
+        """
         self.state = "READY"
+        self.sendLine(codec.encode_proto(codec.FEATURES))
+        if shapes_hash is not None:
+            self.sendLine(codec.encode_have(shapes_hash))
         self.sendLine("ready {0}".format(self.factory.app.player_name))
 
     def set_wait(self):
@@ -117,6 +189,15 @@ class RootLayout(BoxLayout):
         self.app = App.get_running_app()
         self.players = None
         self.shapes = None
+        self.shapes_hash = None
+        self.geometry = None
+        self.frame_timer = FrameTimer(
+            self.app.config.getboolean("config", "frame_stats"))
+        self.prediction = Prediction()
+        self.throttle = MoveThrottle(
+            self.send_move,
+            self.app.config.getfloat("config", "send_rate"),
+            self.app.config.getfloat("config", "min_distance"))
         self.popup_label = Label(text="Touch to start", font_size="32sp",
                                  halign="center")
         self.popup = Popup(title="", content=self.popup_label,
@@ -142,43 +223,255 @@ class RootLayout(BoxLayout):
     def on_touch_move(self, touch):
         pos = self.from_screen_coords(touch.x, touch.y)
         mrg = 0.04
-        if -mrg <= pos[0] <= 1+mrg and -mrg <= pos[1] <= 1+mrg and self.shapes:
-            self.app.connection.send_player_position(pos)
+        if (-mrg <= pos[0] <= 1+mrg and -mrg <= pos[1] <= 1+mrg
+                and self.shapes and self.playing()):
+            self.throttle.sample(pos)
+
+    def playing(self):
+        """
+        Moves are only sent over a live connection during a round.
+        """
+        connection = self.app.connection
+        return connection is not None and connection.state == "GAME"
+
+    def own_id(self):
+        return int(self.player_id) if self.player_id else None
+
+    def set_shapes(self, shapes, sweep=False):
+        self.shapes = shapes
+        self.geometry = None
+        self.refresh_shapes()
+        self.prediction.stop()
+        if self.own_id() is not None:
+            self.throttle.reset(shapes[self.own_id()])
+            if self.app.connection.can_predict():
+                self.prediction.reset(shapes, self.own_id(), sweep)
+
+    def send_move(self, pos):
+        if not self.playing():
+            return
+        seq = self.app.connection.send_player_position(pos)
+        if seq is not None and self.prediction.active():
+            self.prediction.move(seq, pos)
+            self.refresh_players()
+
+    def displayed_players(self):
+        """
+        Server players with the own player replaced by its prediction.
+        """
+        if self.players is None or not self.prediction.active():
+            return self.players
+        players = list(self.players)
+        players[self.own_id()] = self.prediction.player()
+        return players
+
+    def refresh_geometry(self):
+        """
+        Called when the drawing container moves or is resized.
+        """
+        self.refresh_shapes()
+        self.refresh_players()
 
     def refresh_shapes(self):
+        """
+        Transforms the shapes to screen coordinates, only when the shapes or
+        the drawing container geometry changed since the last call.
+        """
         if self.shapes is None:
+            self.geometry = None
             self.line_a = [0, 0]
             self.line_b = [0, 0]
             self.progress_a = 0
             self.progress_b = 0
             return
-        line_a = []
-        for point in self.shapes[0]:
-            line_a += self.to_screen_coords(point)
-        self.line_a = line_a
-        line_b = []
-        for point in self.shapes[1]:
-            line_b += self.to_screen_coords(point)
-        self.line_b = line_b
+        pos = tuple(self.drawing_container.pos)
+        size = tuple(self.drawing_container.size)
+        if self.geometry == (pos, size):
+            return
+        start = time.perf_counter()
+        self.geometry = (pos, size)
+        self.line_a = shapes.to_screen(self.shapes[0], pos,
+                                       size).ravel().tolist()
+        self.line_b = shapes.to_screen(self.shapes[1], pos,
+                                       size).ravel().tolist()
+        self.frame_timer.add("shapes", time.perf_counter() - start)
 
     def refresh_players(self):
+        """
+        Updates cursors and progress, called for every state frame and every
+        predicted move.
+        """
         if self.shapes is None:
             self.cursor_a = (0, 0)
             self.cursor_b = (0, 0)
             self.distance = 0
             return
-        self.progress_a = self.players[0][1]
-        self.progress_b = self.players[1][1]
-        a_pos = self.to_screen_coords(self.players[0][0])
-        b_pos = self.to_screen_coords(self.players[1][0])
-        self.cursor_a = (a_pos[0], a_pos[1])
-        self.cursor_b = (b_pos[0], b_pos[1])
-        self.distance = (float(self.players[0][1])/len(self.shapes[0])
-                         - float(self.players[1][1])/len(self.shapes[1]))
-
-    def _update_rect(self, instance, value):
-        self.refresh_shapes()
-        self.refresh_players()
+        start = time.perf_counter()
+        players = self.displayed_players()
+        self.progress_a = players[0][1]
+        self.progress_b = players[1][1]
+        self.cursor_a = self.to_screen_coords(players[0][0])
+        self.cursor_b = self.to_screen_coords(players[1][0])
+        self.distance = (float(players[0][1])/len(self.shapes[0])
+                         - float(players[1][1])/len(self.shapes[1]))
+        if self.own_id() is not None:
+            self.throttle.set_progress(players[self.own_id()][1])
+        self.frame_timer.add("players", time.perf_counter() - start)
+
+
+class Prediction(object):
+    """
+    Predicts the own player by applying sent moves to a local GameState at
+    once. Player deltas carry the seq of the last move the server applied;
+    the prediction restarts from that authoritative player and replays the
+    moves sent after it. Progress resets of the margin rule are left to the
+    server, the next delta reconciles them.
+    """
+    MAX_PENDING = 256
+
+    def __init__(self):
+        self.state = None
+        self.player_id = None
+        self.pending = []
+
+    def active(self):
+        return self.state is not None
+
+    def reset(self, shapes, player_id, sweep):
+        self.state = GameState.from_points(shapes[0], shapes[1], False, sweep)
+        self.player_id = player_id
+        self.pending = []
+
+    def stop(self):
+        self.state = None
+        self.pending = []
+
+    def move(self, seq, pos):
+        self.pending.append((seq, pos))
+        if len(self.pending) > self.MAX_PENDING:
+            del self.pending[0]
+        self.state.update(self.player_id, list(pos))
+
+    def acknowledge(self, seq, pos, progress):
+        """
+        Applies the server's player after the move seq.
+        """
+        self.pending = [(s, p) for s, p in self.pending if s > seq]
+        self.state.players[self.player_id][:] = [pos, progress]
+        for _, p in self.pending:
+            self.state.update(self.player_id, list(p))
+
+    def player(self):
+        return self.state.players[self.player_id]
+
+
+class MoveThrottle(object):
+    """
+    Coalesces pointer samples into at most rate moves per second, sending
+    the latest sample of every interval, and drops samples closer than
+    min_distance to the last sent one. A sample reaching the next progress
+    point is always sent at once, so throttling never costs progress.
+    """
+    RADIUS = GameState.RADIUS
+    dist = GameState.dist
+
+    def __init__(self, send, rate, min_distance):
+        self.send = send
+        self.interval = 1. / rate if rate > 0 else 0.
+        self.min_distance = min_distance
+        self.shape = None
+        self.progress = 0
+        # last progress displayed, see set_progress
+        self.shown_progress = 0
+        self.last_pos = None
+        self.last_time = 0.
+        self.pending = None
+        self.sent = 0
+        self.dropped = 0
+
+    def reset(self, shape):
+        self.shape = shape
+        self.progress = 0
+        self.shown_progress = 0
+        self.last_pos = None
+        self.pending = None
+
+    def stop(self):
+        """
+        Drops the pending sample, e.g. when the connection is lost.
+        """
+        self.pending = None
+        Clock.unschedule(self.flush)
+
+    def set_progress(self, progress):
+        """
+        Follows the displayed progress, which lags behind the samples sent
+        without prediction. It only moves forward, except for a margin
+        reset, a drop to 0 after a positive progress.
+        """
+        if progress > self.progress or (progress == 0
+                                        and self.shown_progress > 0):
+            self.progress = progress
+        self.shown_progress = progress
+
+    def reaches_next_point(self, pos):
+        return (self.shape is not None and self.progress < len(self.shape)
+                and self.dist(self.shape[self.progress], pos) <= self.RADIUS)
+
+    def sample(self, pos):
+        now = time.perf_counter()
+        if self.reaches_next_point(pos):
+            self.progress += 1
+            self.emit(pos, now)
+        elif (self.last_pos is not None
+                and self.dist(self.last_pos, pos) < self.min_distance):
+            self.dropped += 1
+        elif now - self.last_time >= self.interval:
+            self.emit(pos, now)
+        else:
+            if self.pending is None:
+                Clock.schedule_once(self.flush,
+                                    self.interval - (now - self.last_time))
+            else:
+                self.dropped += 1
+            self.pending = pos
+
+    def flush(self, *args):
+        if self.pending is not None:
+            self.emit(self.pending, time.perf_counter())
+
+    def emit(self, pos, now):
+        self.pending = None
+        self.last_pos = pos
+        self.last_time = now
+        self.sent += 1
+        self.send(pos)
+
+
+class FrameTimer(object):
+    """
+    Collects durations of the render updates and logs their count, mean and
+    maximum every interval seconds. Disabled timers cost a single call.
+    """
+
+    def __init__(self, enabled=False, interval=5.):
+        self.enabled = enabled
+        self.samples = {}
+        if enabled:
+            Clock.schedule_interval(self.report, interval)
+
+    def add(self, name, seconds):
+        if self.enabled:
+            self.samples.setdefault(name, []).append(seconds)
+
+    def report(self, *args):
+        for name, samples in sorted(self.samples.items()):
+            KivyLogger.info("FrameTimer: {0}: {1} calls, mean {2:.3f} ms, "
+                            "max {3:.3f} ms".format(
+                                name, len(samples),
+                                1000. * sum(samples) / len(samples),
+                                1000. * max(samples)))
+        self.samples = {}
 
 
 class GameClientApp(App):
@@ -187,6 +480,8 @@ class GameClientApp(App):
     """
     connection = None
     should_restart = False
+    # rejoin the round after a connection lost during it
+    rejoin = False
 
     def __init__(self, **kwargs):
         super(GameClientApp, self).__init__(**kwargs)
@@ -196,7 +491,10 @@ class GameClientApp(App):
         config.setdefaults('config', {
             'host': 'localhost',
             'port': 8000,
-            'name': 'player_A'})
+            'name': 'player_A',
+            'frame_stats': 0,
+            'send_rate': 30,
+            'min_distance': 0.002})
 
     def build_settings(self, settings):
         settings.add_json_panel('Shape Samurai', self.config,
@@ -225,14 +523,31 @@ class GameClientApp(App):
 
     def on_connection(self, connection):
         self.connection = connection
+        if self.rejoin:
+            self.rejoin = False
+            self.root.msg_text = "Reconnected"
+            connection.set_ready(self.root.shapes_hash)
+            return
         self.should_restart = True
         self.root.msg_text = "Connected"
         self.root.popup_label.text = "Connected\nTouch to start"
         self.root.popup.open()
 
     def on_connection_lost(self):
+        self.root.throttle.stop()
+        if (self.connection is not None and self.connection.state == "GAME"
+                and self.root.shapes is not None):
+            # keep the shapes, the server resyncs the players on rejoin
+            self.connection = None
+            self.rejoin = True
+            self.root.prediction.stop()
+            self.root.msg_text = "Reconnecting"
+            Clock.schedule_once(lambda _: self.connect_to_server(), 1.)
+            return
         self.root.shapes = None
+        self.root.shapes_hash = None
         self.root.players = None
+        self.root.prediction.stop()
         if (self.connection is not None
                 and self.connection.state == "FINISHED"):
             self.root.msg_text = "Game finished"
@@ -246,12 +561,37 @@ class GameClientApp(App):
 
     def update_game(self, game_state):
         if "shapes" in game_state:
-            self.root.shapes = game_state["shapes"]
-            self.root.refresh_shapes()
+            self.root.set_shapes([shapes.as_points(shape)
+                                  for shape in game_state["shapes"]],
+                                 game_state.get("sweep", False))
+        elif (codec.SHAPES_HASH in game_state
+                and self.root.shapes is not None):
+            # resync after a reconnect, the shapes are cached
+            self.root.set_shapes(self.root.shapes,
+                                 game_state.get("sweep", False))
+        if codec.SHAPES_HASH in game_state:
+            self.root.shapes_hash = game_state[codec.SHAPES_HASH]
         if "players" in game_state:
             self.root.players = game_state["players"]
+            if self.root.prediction.active():
+                self.root.prediction.acknowledge(
+                    0, *self.root.players[self.root.own_id()])
             self.root.refresh_players()
 
+    def update_player(self, player_id, pos, progress, seq=None, sent=None):
+        if self.root.players is None:
+            return
+        if sent is not None and player_id == self.root.own_id():
+            # time from sending the move to seeing it applied
+            self.root.frame_timer.add(
+                "move latency", self.connection.sync.remote_time(time.time())
+                - sent)
+        if (player_id == self.root.own_id()
+                and self.root.prediction.active()):
+            self.root.prediction.acknowledge(seq or 0, pos, progress)
+        self.root.players[player_id] = [pos, progress]
+        self.root.refresh_players()
+
     def on_game_start(self):
         self.root.msg_text = "Distance"
         self.root.popup.dismiss()
@@ -268,8 +608,9 @@ class GameClientApp(App):
         self.should_restart = True
 
     def on_stop(self):
-        if self.connection is not None:
-            self.connection.transport.loseConnection()
+        connection, self.connection = self.connection, None
+        if connection is not None:
+            connection.transport.loseConnection()
         return True
 
     def on_pause(self):
@@ -0,0 +1,6 @@
+"""
+Modules shared by the server, the client and the tools: the wire protocol
+(codec), shape interpolation (shapes), the game logic (game_state) and
+clock synchronization (timesync). Entry points put the repository root on
+sys.path and import them as the common package.
+"""
@@ -0,0 +1,206 @@
+"""
+Message encoding shared by the server and the client.
+
+Besides the original chunked JSON game states, the protocol supports
+optional features negotiated with a "proto" line sent before "ready":
+
+    client: proto delta
+    server: proto delta
+
+Features not acknowledged by the server are not used, so old clients and
+old servers keep talking JSON.
+
+* delta -- after the round start, player updates are sent as short
+  fixed-format lines carrying only the players which changed:
+
+      @p <player_id> <x> <y> <progress>
+
+* quant -- moves from the client are quantized to 16 bit integers over
+  [QUANT_MIN, QUANT_MAX] and sent as "q<x>,<y>" instead of float reprs.
+
+* time -- either side may send "ping <seq> <time>", answered with
+  "pong <seq> <time> <responder time>", for round trip times and clock
+  offsets. Moves get a sequence number and a timestamp in server time
+  appended, "<move>;<seq>;<time>", and player deltas carry the sequence
+  number and timestamp of the last move applied:
+
+      @p <player_id> <x> <y> <progress> <seq> <time>
+
+* frame -- JSON game states from the server are sent as a single
+  length-prefixed frame instead of MAX_LENGTH chunks ended by "json_end":
+
+      frame <length>
+      <length> bytes of UTF-8 JSON
+
+  The receiver switches to raw mode for the frame body and collects it in a
+  preallocated buffer with FrameReader, so large shapes cost linear time.
+
+Round start states carry a "shapes_hash" of their shapes. A client which
+lost its connection during a round may send "have <shapes_hash>" before
+"ready" when it reconnects; if the server kept its room and the round still
+has those shapes, the state following "start" is a resync without "shapes".
+Clients which do not know the key ignore it and never send "have".
+"""
+import hashlib
+import json
+
+PROTO = "proto"
+DELTA = "delta"
+QUANT = "quant"
+TIME = "time"
+FRAME = "frame"
+FEATURES = (DELTA, QUANT, TIME, FRAME)
+
+DELTA_PREFIX = "@"
+PLAYER = "@p"
+MOVE_QUANT = "q"
+PING = "ping"
+PONG = "pong"
+HAVE = "have"
+SHAPES_HASH = "shapes_hash"
+
+QUANT_MIN = -0.5
+QUANT_MAX = 1.5
+QUANT_STEPS = 65535
+
+
+def encode_proto(features):
+    return " ".join((PROTO,) + tuple(features))
+
+
+def decode_proto(line):
+    """
+    Returns the set of features listed in a "proto" line.
+    """
+    return set(line.split()[1:])
+
+
+def negotiate(requested, supported=FEATURES):
+    return [feature for feature in supported if feature in requested]
+
+
+def encode_player(player_id, player, seq=None, sent=None):
+    pos, progress = player
+    line = "{0} {1} {2:.5f} {3:.5f} {4}".format(PLAYER, player_id, pos[0],
+                                                pos[1], progress)
+    if seq is not None:
+        line += " {0} {1:.3f}".format(seq, sent)
+    return line
+
+
+def decode_player(line):
+    """
+    Decodes a player delta line into (player_id, position, progress, seq,
+    sent), the last two are None unless the time feature is used.
+    """
+    fields = line.split(" ")
+    seq = sent = None
+    if len(fields) == 7:
+        seq, sent = int(fields[5]), float(fields[6])
+    return (int(fields[1]), [float(fields[2]), float(fields[3])],
+            int(fields[4]), seq, sent)
+
+
+def encode_frame_header(length):
+    return "{0} {1}".format(FRAME, length)
+
+
+def decode_frame_header(line):
+    return int(line[len(FRAME) + 1:])
+
+
+class FrameReader(object):
+    """
+    Collects a frame body of known length from raw data chunks, copying
+    every byte once into a preallocated buffer.
+    """
+
+    def __init__(self, length):
+        self.buffer = bytearray(length)
+        self.view = memoryview(self.buffer)
+        self.received = 0
+
+    def feed(self, data):
+        """
+        Adds data, returns the bytes following the frame once it is
+        complete, otherwise None.
+        """
+        data = memoryview(data)
+        count = min(len(data), len(self.buffer) - self.received)
+        self.view[self.received:self.received + count] = data[:count]
+        self.received += count
+        if self.received < len(self.buffer):
+            return None
+        return data[count:].tobytes()
+
+    def decode(self):
+        return json.loads(self.buffer)
+
+
+def shapes_hash(shapes):
+    """
+    Returns a short digest of shapes given as lists of points.
+    """
+    data = json.dumps(shapes, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha1(data).hexdigest()[:16]
+
+
+def encode_have(digest):
+    return "{0} {1}".format(HAVE, digest)
+
+
+def decode_have(line):
+    return line[len(HAVE) + 1:]
+
+
+def encode_ping(seq, now):
+    return "{0} {1} {2:.6f}".format(PING, seq, now)
+
+
+def encode_pong(ping_line, now):
+    return "{0}{1} {2:.6f}".format(PONG, ping_line[len(PING):], now)
+
+
+def decode_pong(line):
+    """
+    Decodes a pong line into (seq, ping time, responder time).
+    """
+    _, seq, sent, remote = line.split(" ")
+    return int(seq), float(sent), float(remote)
+
+
+def quantize(value):
+    value = min(max(value, QUANT_MIN), QUANT_MAX)
+    return int(round((value - QUANT_MIN) / (QUANT_MAX - QUANT_MIN)
+                     * QUANT_STEPS))
+
+
+def dequantize(value):
+    return QUANT_MIN + value * (QUANT_MAX - QUANT_MIN) / QUANT_STEPS
+
+
+def encode_move(pos, quantized=False, seq=None, sent=None):
+    if quantized:
+        line = "{0}{1},{2}".format(MOVE_QUANT, quantize(pos[0]),
+                                   quantize(pos[1]))
+    else:
+        line = "{0},{1}".format(*pos)
+    if seq is not None:
+        line += ";{0};{1:.3f}".format(seq, sent)
+    return line
+
+
+def decode_move(line):
+    """
+    Decodes a move line in any encoding into ([x, y], seq, sent), seq and
+    sent are None for moves without them.
+    """
+    seq = sent = None
+    if ";" in line:
+        line, seq, sent = line.split(";")
+        seq, sent = int(seq), float(sent)
+    if line[:1] == MOVE_QUANT:
+        pos = [dequantize(int(value)) for value in line[1:].split(",")]
+    else:
+        pos = [float(value) for value in line.split(",")]
+    return pos, seq, sent
@@ -0,0 +1,102 @@
+import math
+
+from common import shapes
+
+
+class GameState(object):
+    """
+    GameState represent current state of the game. Game logic is implemented
+    here. The server runs the authoritative state, clients run a copy to
+    predict their own progress.
+    """
+    RADIUS = 0.04
+    PROGRESS_MARGIN = 0.2
+
+    def __init__(self, shape_a, shape_b, use_margin=True, sweep=False):
+        """
+        The player list consists of a position tuple and progress index.
+
+        In sweep mode a move advances over all consecutive points within
+        RADIUS of the segment between the previous and the new position,
+        otherwise only the next point is checked.
+        """
+        self.setup((self.interpolate_shape(shape_a),
+                    self.interpolate_shape(shape_b)), use_margin, sweep)
+
+    @classmethod
+    def from_points(cls, points_a, points_b, use_margin=True, sweep=False):
+        """
+        Creates a game state from already interpolated shapes, e.g. taken
+        from a compiled shape library.
+        """
+        state = cls.__new__(cls)
+        state.setup((points_a, points_b), use_margin, sweep)
+        return state
+
+    def setup(self, shapes, use_margin, sweep):
+        self.shapes = shapes
+        self.players = ([self.shapes[0][0].tolist(), 0],
+                        [self.shapes[1][0].tolist(), 0])
+        self.use_margin = use_margin
+        self.sweep = sweep
+        # number of progress resets after exceeding PROGRESS_MARGIN
+        self.resets = 0
+        # indexing Python floats one by one is much faster than NumPy
+        self.points = (self.shapes[0].tolist(), self.shapes[1].tolist())
+
+    def dist(self, a, b):
+        return math.hypot(a[0]-b[0], a[1]-b[1])
+
+    def interpolate_shape(self, verts, density=shapes.DENSITY):
+        return shapes.interpolate_shape(verts, density)
+
+    def segment_dist(self, p, a, b):
+        """
+        Distance from point p to the segment a-b.
+        """
+        dx, dy = b[0] - a[0], b[1] - a[1]
+        length = dx*dx + dy*dy
+        if length == 0:
+            return self.dist(p, a)
+        t = ((p[0] - a[0])*dx + (p[1] - a[1])*dy) / length
+        t = min(max(t, 0.), 1.)
+        return self.dist(p, (a[0] + t*dx, a[1] + t*dy))
+
+    def sweep_progress(self, player_id, start, end):
+        """
+        Returns the progress index after advancing over consecutive points
+        within RADIUS of the segment start-end.
+        """
+        points = self.points[player_id]
+        progress = self.players[player_id][1]
+        while (progress < len(points)
+               and self.segment_dist(points[progress], start,
+                                     end) <= self.RADIUS):
+            progress += 1
+        return progress
+
+    def update(self, player_id, position):
+        player = self.players[player_id]
+        shape = self.points[player_id]
+        previous = player[0]
+        player[0] = position
+
+        # Is next point visited?
+        if self.sweep:
+            player[1] = self.sweep_progress(player_id, previous, position)
+        elif (player[1] < len(shape)
+                and self.dist(shape[player[1]], position) <= self.RADIUS):
+            player[1] += 1
+
+        # Is distance exceeded?
+        points = self.points
+        if self.use_margin and (abs(self.players[0][1]/len(points[0])
+                                - self.players[1][1]/len(points[1]))
+                                > self.PROGRESS_MARGIN):
+            self.players[0][1] = 0
+            self.players[1][1] = 0
+            self.resets += 1
+
+        # Do both players finished?
+        return (self.players[0][1] == len(points[0])
+                and self.players[1][1] == len(points[1]))
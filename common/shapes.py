@@ -0,0 +1,111 @@
+"""
+Shape representation shared by the server, the client and the shape
+generator. Shapes are closed polygons in normalized [0, 1] coordinates held
+as contiguous (n, 2) float64 arrays.
+"""
+import numpy as np
+
+DENSITY = 0.01
+
+
+def as_points(points):
+    """
+    Returns points as a contiguous (n, 2) float64 array, without copying
+    when they already are one.
+    """
+    return np.ascontiguousarray(points, dtype=np.float64).reshape(-1, 2)
+
+
+def interpolate_shape(verts, density=DENSITY):
+    """
+    Interpolates the closed polygon so that consecutive points are at most
+    density apart. Every edge starts with its vertex followed by
+    floor(length / density) evenly spaced points, the last of which is the
+    next vertex. All edges are expanded in a single vectorized pass.
+    """
+    verts = as_points(verts)
+    if len(verts) == 0:
+        return verts
+    deltas = np.roll(verts, -1, axis=0) - verts
+    splits = np.floor(np.hypot(deltas[:, 0], deltas[:, 1]) / density)
+    splits = splits.astype(np.int64)
+    counts = splits + 1
+
+    edges = np.repeat(np.arange(len(verts)), counts)
+    steps = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                counts)
+    t = steps / np.maximum(splits, 1)[edges]
+    return verts[edges] + t[:, None] * deltas[edges]
+
+
+def shape_length(points):
+    """
+    Perimeter of the closed polygon.
+    """
+    points = as_points(points)
+    deltas = np.roll(points, -1, axis=0) - points
+    return float(np.hypot(deltas[:, 0], deltas[:, 1]).sum())
+
+
+def to_screen(points, pos, size):
+    """
+    Transforms normalized points to screen coordinates of a widget with the
+    given position and size.
+    """
+    return as_points(points) * size + pos
+
+
+def shape_features(polygons, radius, density=DENSITY):
+    """
+    Difficulty features of many polygons, computed in one vectorized pass
+    over all their vertices. Returns a dict of arrays with one value per
+    polygon:
+
+    * perimeter
+    * points -- number of interpolated points at the given density
+    * turning_mean, turning_max, turning_std -- absolute turning angles at
+      the vertices, in radians
+    * convexity -- fraction of vertices turning in the polygon's overall
+      direction, 1 for convex polygons
+    * points_per_window -- interpolated points within an arc of 2 * radius,
+      i.e. points which can be passed by a single move
+    """
+    verts = [as_points(polygon) for polygon in polygons]
+    counts = np.array([len(v) for v in verts], dtype=np.int64)
+    if len(verts) == 0:
+        return {}
+    flat = np.concatenate(verts)
+    starts = np.cumsum(counts) - counts
+    shape_ids = np.repeat(np.arange(len(verts)), counts)
+    local = np.arange(len(flat)) - starts[shape_ids]
+    following = starts[shape_ids] + (local + 1) % counts[shape_ids]
+    preceding = starts[shape_ids] + (local - 1) % counts[shape_ids]
+
+    def per_shape(values):
+        return np.bincount(shape_ids, values, minlength=len(verts))
+
+    out_edges = flat[following] - flat
+    in_edges = flat - flat[preceding]
+    edge_lengths = np.hypot(out_edges[:, 0], out_edges[:, 1])
+    perimeter = per_shape(edge_lengths)
+    points = per_shape(np.floor(edge_lengths / density) + 1).astype(np.int64)
+
+    turning = np.arctan2(
+        in_edges[:, 0] * out_edges[:, 1] - in_edges[:, 1] * out_edges[:, 0],
+        (in_edges * out_edges).sum(axis=1))
+    total_turning = per_shape(turning)
+    abs_turning = np.abs(turning)
+    mean_turning = total_turning / counts
+    convex = np.sign(turning) == np.sign(total_turning)[shape_ids]
+
+    return {
+        "perimeter": perimeter,
+        "points": points,
+        "turning_mean": per_shape(abs_turning) / counts,
+        "turning_max": np.maximum.reduceat(abs_turning, starts),
+        "turning_std": np.sqrt(np.maximum(
+            per_shape(turning ** 2) / counts - mean_turning ** 2, 0)),
+        "convexity": per_shape(convex) / counts,
+        "points_per_window": points * 2 * radius / np.maximum(perimeter,
+                                                              1e-12),
+    }
@@ -0,0 +1,32 @@
+from collections import deque
+
+
+class ClockSync(object):
+    """
+    Round trip time and clock offset estimates from ping/pong exchanges.
+    As in NTP the offset is taken from the sample with the lowest round trip
+    time among the last WINDOW ones, its error is at most half of that time.
+    """
+    WINDOW = 16
+
+    def __init__(self):
+        self.seq = 0
+        self.samples = deque(maxlen=self.WINDOW)
+        self.rtt = None
+        self.offset = 0.
+
+    def next_seq(self):
+        self.seq += 1
+        return self.seq
+
+    def pong(self, sent, remote, now):
+        """
+        Adds a sample from a ping sent at local time sent and answered at
+        remote time remote, received at local time now.
+        """
+        self.rtt = now - sent
+        self.samples.append((self.rtt, remote - (sent + self.rtt / 2)))
+        self.offset = min(self.samples)[1]
+
+    def remote_time(self, now):
+        return now + self.offset
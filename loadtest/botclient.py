@@ -0,0 +1,197 @@
+"""
+Headless bot clients speaking the game protocol, used by the load testing
+tools. Bots connect, negotiate features, report ready and play the rounds
+the server starts, reporting move latency to a shared BotStats.
+"""
+import json
+import os
+import time
+
+import numpy as np
+from twisted.internet import reactor
+from twisted.internet.protocol import ClientFactory
+from twisted.protocols.basic import LineReceiver
+
+from common import codec
+
+
+class BotStats(object):
+    """
+    Counters shared by all bots of a run. A move's latency is the time from
+    sending it to receiving the first frame which reflects it.
+    """
+
+    def __init__(self):
+        self.latencies = []
+        self.moves = 0
+        self.frames = 0
+        self.rounds = 0
+        self.started = time.time()
+
+    def summary(self):
+        elapsed = time.time() - self.started
+        summary = {"elapsed": elapsed, "moves": self.moves,
+                   "frames": self.frames, "rounds": self.rounds,
+                   "moves_per_s": self.moves / elapsed,
+                   "frames_per_s": self.frames / elapsed}
+        if self.latencies:
+            latencies = np.array(self.latencies) * 1000.
+            for q in (50, 90, 99):
+                summary["latency_p{0}_ms".format(q)] = float(
+                    np.percentile(latencies, q))
+            summary["latency_max_ms"] = float(latencies.max())
+        return summary
+
+
+class BotProtocol(LineReceiver):
+    """
+    BotProtocol follows the client side of the protocol. Subclasses decide
+    how to play by overriding round_started and round_finished.
+    """
+    ready_delay = 0.
+
+    def __init__(self, name, stats, features=codec.FEATURES):
+        self.name = name
+        self.stats = stats
+        self.requested_features = features
+        self.features = set()
+        self.state = "WAIT"
+        self.msg_buffer = []
+        self.frame = None
+        self.player_id = None
+        self.two_player_game = False
+        self.shapes = None
+        self.players = None
+        self.pending = []
+
+    def connectionMade(self):
+        self.set_ready()
+
+    def lineReceived(self, line):
+        line = line.decode("utf-8")
+        if line[:5] == codec.PROTO:
+            self.features = codec.decode_proto(line)
+        elif line[:4] == codec.PING:
+            self.sendLine(codec.encode_pong(line, time.time()))
+        elif self.state == "READY":
+            if line[:5] == "start":
+                self.two_player_game = bool(int(line[6]))
+                self.player_id = int(line[8])
+                self.state = "GAME"
+                self.shapes = None
+            elif line == "finish":
+                self.state = "FINISHED"
+                self.game_finished()
+        elif self.state == "GAME":
+            if line == "reset":
+                self.state = "WAIT"
+                self.pending = []
+                self.stats.rounds += 1
+                self.round_finished()
+                reactor.callLater(self.ready_delay, self.set_ready)
+            elif line[:2] == codec.PLAYER:
+                player_id, pos, progress, _, _ = codec.decode_player(line)
+                self.update_players({player_id: [pos, progress]})
+            elif line[:6] == codec.FRAME + " ":
+                self.frame = codec.FrameReader(codec.decode_frame_header(line))
+                self.setRawMode()
+            elif line == "json_end":
+                state = json.loads("".join(self.msg_buffer))
+                self.msg_buffer = []
+                self.update_game(state)
+            else:
+                self.msg_buffer.append(line)
+
+    def rawDataReceived(self, data):
+        rest = self.frame.feed(data)
+        if rest is None:
+            return
+        state = self.frame.decode()
+        self.frame = None
+        self.update_game(state)
+        self.setLineMode(rest)
+
+    def sendLine(self, line):
+        LineReceiver.sendLine(self, line.encode("utf-8"))
+
+    def set_ready(self):
+        if not self.connected:
+            return
+        self.state = "READY"
+        if self.requested_features:
+            self.sendLine(codec.encode_proto(self.requested_features))
+        self.sendLine("ready {0}".format(self.name))
+
+    def update_game(self, state):
+        if "players" in state:
+            self.update_players(dict(enumerate(state["players"])))
+        if "shapes" in state:
+            self.shapes = state["shapes"]
+            self.round_started()
+
+    def update_players(self, players):
+        if self.players is None:
+            self.players = [None, None]
+        for player_id, player in players.items():
+            self.players[player_id] = player
+        self.stats.frames += 1
+        own = players.get(self.player_id)
+        if own is not None and self.pending:
+            key = (round(own[0][0], 5), round(own[0][1], 5))
+            now = time.time()
+            for i, (pending_key, _) in enumerate(self.pending):
+                if pending_key == key:
+                    self.stats.latencies.extend(
+                        now - t for _, t in self.pending[:i + 1])
+                    del self.pending[:i + 1]
+                    break
+
+    def send_move(self, pos):
+        if self.state != "GAME" or not self.connected:
+            return
+        self.sendLine("{0},{1}".format(*pos))
+        self.pending.append(((round(pos[0], 5), round(pos[1], 5)),
+                             time.time()))
+        self.stats.moves += 1
+
+    def round_started(self):
+        pass
+
+    def round_finished(self):
+        pass
+
+    def game_finished(self):
+        self.transport.loseConnection()
+
+
+class BotFactory(ClientFactory):
+    """
+    Creates a single bot connection, build is called with the factory and
+    returns the protocol instance.
+    """
+
+    def __init__(self, build, on_lost=None):
+        self.build = build
+        self.on_lost = on_lost
+
+    def buildProtocol(self, addr):
+        protocol = self.build()
+        protocol.factory = self
+        return protocol
+
+    def clientConnectionLost(self, connector, reason):
+        if self.on_lost is not None:
+            self.on_lost()
+
+    def clientConnectionFailed(self, connector, reason):
+        if self.on_lost is not None:
+            self.on_lost()
+
+
+def process_cpu_seconds(pid):
+    """
+    User and system CPU seconds of a local process, read from /proc.
+    """
+    with open("/proc/{0}/stat".format(pid)) as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
@@ -0,0 +1,148 @@
+"""
+Synthetic bots tracing the shapes they receive, for capacity tests without
+the Kivy client.
+
+    python bots.py --bots 2000 --rate 30 --speed 0.3 --noise 0.005 \
+        --desync 0.1 --duration 60
+
+All bots of the process are stepped by a single BotDriver loop, so thousands
+of bots cost one timer.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+
+# the repository root, holding the shared common package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+import numpy as np
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+
+from botclient import BotFactory, BotProtocol, BotStats
+
+
+class BotDriver(object):
+    """
+    Steps all tracing bots rate times per second.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.bots = set()
+        self.loop = LoopingCall(self.step)
+
+    def start(self):
+        self.loop.start(1. / self.rate, now=False)
+
+    def step(self):
+        for bot in list(self.bots):
+            bot.step()
+
+
+class TracingBot(BotProtocol):
+    """
+    Moves along its shape at speed shape units per second, with gaussian
+    noise of the given standard deviation added to every position. Player 1
+    of a pair is slowed down by the desync fraction. When the server resets
+    the progress the bot goes back to the reported progress point.
+    """
+    RESET_SLACK = 0.1
+
+    def __init__(self, name, stats, driver, speed, noise=0., desync=0.,
+                 rng=random):
+        super(TracingBot, self).__init__(name, stats)
+        self.driver = driver
+        self.speed = speed
+        self.noise = noise
+        self.desync = desync
+        self.rng = rng
+        self.points = None
+
+    def round_started(self):
+        self.points = np.asarray(self.shapes[self.player_id])
+        deltas = np.diff(self.points, axis=0)
+        self.arc = np.concatenate([[0.], np.cumsum(np.hypot(deltas[:, 0],
+                                                            deltas[:, 1]))])
+        self.distance = 0.
+        self.step_length = self.speed / self.driver.rate
+        if self.player_id == 1:
+            self.step_length *= 1. - self.desync
+        self.driver.bots.add(self)
+
+    def round_finished(self):
+        self.driver.bots.discard(self)
+
+    def connectionLost(self, reason):
+        self.driver.bots.discard(self)
+
+    def update_players(self, players):
+        super(TracingBot, self).update_players(players)
+        own = players.get(self.player_id)
+        if own is None or self.points is None:
+            return
+        progress = min(own[1], len(self.points) - 1)
+        if self.arc[progress] + self.RESET_SLACK < self.distance:
+            self.distance = self.arc[progress]
+
+    def step(self):
+        self.distance = min(self.distance + self.step_length, self.arc[-1])
+        index = min(np.searchsorted(self.arc, self.distance),
+                    len(self.points) - 1)
+        x, y = self.points[index]
+        if self.noise > 0:
+            x += self.rng.gauss(0, self.noise)
+            y += self.rng.gauss(0, self.noise)
+        self.send_move((float(x), float(y)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run synthetic bots "
+                                     "against a running server")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--bots", type=int, default=2)
+    parser.add_argument("--rate", type=float, default=30.,
+                        help="moves per second sent by every bot")
+    parser.add_argument("--speed", type=float, default=0.3,
+                        help="tracing speed in shape units per second")
+    parser.add_argument("--noise", type=float, default=0.)
+    parser.add_argument("--desync", type=float, default=0.,
+                        help="fraction by which player 1 is slower")
+    parser.add_argument("--ramp", type=float, default=200.,
+                        help="new connections per second")
+    parser.add_argument("--duration", type=float, default=60.)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--output", help="write the summary as JSON")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    stats = BotStats()
+    driver = BotDriver(args.rate)
+
+    def connect(index):
+        name = "bot-{0:06d}".format(index)
+        factory = BotFactory(lambda: TracingBot(name, stats, driver,
+                                                args.speed, args.noise,
+                                                args.desync, rng))
+        reactor.connectTCP(args.host, args.port, factory)
+
+    for index in range(args.bots):
+        reactor.callLater(index / args.ramp, connect, index)
+    reactor.callWhenRunning(driver.start)
+    reactor.callLater(args.duration, reactor.stop)
+    reactor.run()
+
+    summary = stats.summary()
+    summary["bots"] = args.bots
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Parsing of recorded sessions, both the NDJSON written by
+server/recorder.py and the text logs of server/logger.py with lines like
+
+    [2017-11-18 16:43:39,123] INFO root player: 0-name, move: [0.1, 0.2]
+
+Sessions are returned as {room: {player_name: rounds}}, where rounds is a
+list with, for every round, the (t, x, y) moves with t in seconds from the
+round start.
+"""
+import json
+import re
+from collections import defaultdict
+from datetime import datetime
+
+TEXT_LINE = re.compile(r"\[(?P<time>[^\]]+)\] \w+\s+(?P<name>\S+)\s+"
+                       r"(?P<message>.*)")
+TEXT_MOVE = re.compile(r"player: (?P<player>\d+)-(?P<player_name>.*), "
+                       r"move: \[(?P<x>[^,]+), (?P<y>[^\]]+)\]")
+TEXT_TIME = "%Y-%m-%d %H:%M:%S,%f"
+
+
+def read_ndjson(path):
+    rooms = defaultdict(lambda: defaultdict(list))
+    starts = {}
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            if "room" not in record:
+                continue
+            key = (record["room"], record["round"])
+            if record.get("event") == "start":
+                starts[key] = record["t"]
+            elif "player" in record:
+                rounds = rooms[record["room"]][record["name"]]
+                while len(rounds) <= record["round"]:
+                    rounds.append([])
+                rounds[record["round"]].append(
+                    (record["t"] - starts.get(key, record["t"]),
+                     record["x"], record["y"]))
+    return rooms
+
+
+def read_text(path):
+    """
+    Text logs from before rooms existed hold a single pair; rounds start
+    with "Game started" messages. Their Logger wrote every record twice,
+    from two handlers whose copies interleave under load, so the second
+    occurrence of a line, timestamp included, is skipped. unpaired holds
+    the lines whose copy has not been seen yet.
+    """
+    rooms = defaultdict(lambda: defaultdict(list))
+    round_index = -1
+    start = None
+    unpaired = set()
+    with open(path) as f:
+        for line in f:
+            match = TEXT_LINE.match(line)
+            if match is None:
+                continue
+            if line in unpaired:
+                unpaired.remove(line)
+                continue
+            unpaired.add(line)
+            t = datetime.strptime(match.group("time"),
+                                  TEXT_TIME).timestamp()
+            message = match.group("message")
+            room = match.group("name")
+            if message.startswith("Game started"):
+                round_index += 1
+                start = t
+                continue
+            move = TEXT_MOVE.match(message)
+            if move is None or round_index < 0:
+                continue
+            rounds = rooms[room][move.group("player_name")]
+            while len(rounds) <= round_index:
+                rounds.append([])
+            rounds[round_index].append((t - start, float(move.group("x")),
+                                        float(move.group("y"))))
+    return rooms
+
+
+def read_session(path):
+    with open(path) as f:
+        first = f.readline()
+    if first.startswith("{"):
+        return read_ndjson(path)
+    return read_text(path)
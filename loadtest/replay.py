@@ -0,0 +1,147 @@
+"""
+Replays recorded sessions against a running server with many bot pairs and
+reports move latency percentiles, broadcast throughput and, given the server
+pid, server CPU per room.
+
+    python replay.py ../server/XXX.ndjson --pairs 100 --speed 4 \
+        --server-pid 1234
+
+Pairs are started one after another, each once the previous one has had its
+round started, so the server pairs the bots as recorded.
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+
+# the repository root, holding the shared common package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+from twisted.internet import reactor
+
+from botclient import BotFactory, BotProtocol, BotStats, process_cpu_seconds
+from logs import read_session
+
+
+class ReplayBot(BotProtocol):
+    """
+    Sends the recorded moves of every round at their recorded times divided
+    by speed.
+    """
+
+    def __init__(self, name, stats, rounds, speed, on_started=None):
+        super(ReplayBot, self).__init__(name, stats)
+        self.rounds = rounds
+        self.speed = speed
+        self.on_started = on_started
+        self.round_index = 0
+        self.calls = []
+
+    def round_started(self):
+        if self.on_started is not None:
+            self.on_started()
+            self.on_started = None
+        if self.round_index >= len(self.rounds):
+            self.transport.loseConnection()
+            return
+        moves = self.rounds[self.round_index]
+        self.calls = [reactor.callLater(t / self.speed, self.send_move,
+                                        (x, y)) for t, x, y in moves]
+        self.round_index += 1
+
+    def round_finished(self):
+        for call in self.calls:
+            if call.active():
+                call.cancel()
+        self.calls = []
+
+    def connectionLost(self, reason):
+        self.round_finished()
+
+
+class Replay(object):
+
+    def __init__(self, recorded, host, port, pairs, speed, stats):
+        self.recorded = itertools.cycle(
+            [players for players in recorded.values() if len(players) == 2])
+        self.host = host
+        self.port = port
+        self.pairs = pairs
+        self.speed = speed
+        self.stats = stats
+        self.started = 0
+        self.active = 0
+
+    def start_pair(self):
+        if self.started >= self.pairs:
+            return
+        index = self.started
+        self.started += 1
+        players = next(self.recorded)
+        waiting = [len(players)]
+
+        def started():
+            waiting[0] -= 1
+            if waiting[0] == 0:
+                self.start_pair()
+
+        for name, rounds in sorted(players.items()):
+            self.active += 1
+            bot_name = "{0}-{1:05d}".format(name, index)
+            factory = BotFactory(
+                lambda n=bot_name, r=rounds: ReplayBot(n, self.stats, r,
+                                                       self.speed, started),
+                self.bot_lost)
+            reactor.connectTCP(self.host, self.port, factory)
+
+    def bot_lost(self):
+        self.active -= 1
+        if self.active == 0 and self.started >= self.pairs:
+            reactor.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded sessions "
+                                     "against a running server")
+    parser.add_argument("session", help="NDJSON recording or text log")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--pairs", type=int, default=1)
+    parser.add_argument("--speed", type=float, default=1.,
+                        help="replay speed, 1 is real time")
+    parser.add_argument("--duration", type=float, default=0,
+                        help="stop after this many seconds, 0 runs until "
+                        "all recordings end")
+    parser.add_argument("--server-pid", type=int,
+                        help="local server process to measure CPU of")
+    parser.add_argument("--output", help="write the summary as JSON")
+    args = parser.parse_args(argv)
+
+    recorded = read_session(args.session)
+    stats = BotStats()
+    replay = Replay(recorded, args.host, args.port, args.pairs, args.speed,
+                    stats)
+    cpu = (process_cpu_seconds(args.server_pid)
+           if args.server_pid is not None else None)
+    reactor.callWhenRunning(replay.start_pair)
+    if args.duration > 0:
+        reactor.callLater(args.duration, reactor.stop)
+    reactor.run()
+
+    summary = stats.summary()
+    summary["pairs"] = replay.started
+    if cpu is not None:
+        cpu = process_cpu_seconds(args.server_pid) - cpu
+        summary["server_cpu_s"] = cpu
+        summary["server_cpu_per_room"] = cpu / max(replay.started, 1)
+        summary["server_cpu_utilization"] = cpu / summary["elapsed"]
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""
+Headless game server on an asyncio event loop, uvloop if installed and
+requested, instead of the Twisted reactor:
+
+    python aio_server.py --session XXX --port 8000 [--uvloop]
+
+The connection state machine and rooms are those of connection.py and
+lobby.py, shared with the Twisted server (game_server.py), so both servers
+speak exactly the same protocol. Nothing of Twisted is imported here:
+AsyncioConnection splits lines itself and the lobby timers run on the
+asyncio loop.
+"""
+import argparse
+import asyncio
+import os
+import signal
+import sys
+
+# the repository root, holding the shared common package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+from connection import ServerConnection
+from journal import SessionJournal
+from library import load_library, order_by
+from lobby import Lobby
+from logger import Logger
+from recorder import SessionRecorder
+
+
+class AsyncioConnection(ServerConnection, asyncio.Protocol):
+    """
+    Runs a ServerConnection on an asyncio transport, splitting the received
+    bytes into lines as LineReceiver does.
+    """
+
+    def __init__(self, factory):
+        super(AsyncioConnection, self).__init__()
+        self.factory = factory
+        self.transport = None
+        self.buffer = b""
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.connectionMade()
+
+    def data_received(self, data):
+        self.factory.bytes_received += len(data)
+        data = self.buffer + data
+        start = 0
+        while self.transport is not None:
+            end = data.find(self.delimiter, start)
+            if end < 0:
+                break
+            if end - start > self.MAX_LENGTH:
+                self.disconnect()
+                return
+            line = data[start:end]
+            start = end + len(self.delimiter)
+            self.lineReceived(line)
+        self.buffer = data[start:]
+        if len(self.buffer) > self.MAX_LENGTH:
+            self.disconnect()
+
+    def connection_lost(self, exc):
+        self.connectionLost(exc)
+
+    def write(self, data):
+        # as with Twisted's loseConnection, writes after disconnect() are
+        # dropped; connection_lost follows later
+        if self.transport is not None:
+            self.transport.write(data)
+
+    def disconnect(self):
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+
+class AsyncioLobby(Lobby):
+    """
+    Runs the Lobby timers on an asyncio loop.
+    """
+
+    def __init__(self, loop, *args, **kwargs):
+        super(AsyncioLobby, self).__init__(*args, **kwargs)
+        self.loop = loop
+        self.calls = {}
+        for function, interval in self.timers():
+            if interval > 0:
+                self.repeat(function, interval)
+
+    def repeat(self, function, interval):
+        self.calls[function] = self.loop.call_later(
+            interval, self.repeated, function, interval)
+
+    def repeated(self, function, interval):
+        self.repeat(function, interval)
+        function()
+
+    def call_later(self, delay, function, *args):
+        return self.loop.call_later(delay, function, *args)
+
+    def stop(self):
+        for call in self.calls.values():
+            call.cancel()
+        self.calls = {}
+        super(AsyncioLobby, self).stop()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Headless Shape Samurai "
+                                     "server on asyncio")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--shapes-file", default="shape_library.json")
+    parser.add_argument("--session", default="XXX",
+                        help="session name, the log is written to "
+                        "<session>.txt")
+    parser.add_argument("--stats-interval", type=float, default=10.)
+    parser.add_argument("--tick-rate", type=float, default=0.)
+    parser.add_argument("--sweep", action="store_true")
+    parser.add_argument("--round-order", default="")
+    parser.add_argument("--ping-interval", type=float, default=2.)
+    parser.add_argument("--journal-interval", type=float, default=1.,
+                        help="seconds between writes of <session>.journal, "
+                        "0 disables it")
+    parser.add_argument("--reconnect-window", type=float, default=10.,
+                        help="seconds a room waits for a disconnected "
+                        "player, 0 closes it at once")
+    parser.add_argument("--resume-wait", type=float, default=30.,
+                        help="seconds a journaled player waits for the "
+                        "partner, 0 disables resuming")
+    parser.add_argument("--uvloop", action="store_true",
+                        help="run on uvloop, which must be installed")
+    return parser.parse_args(argv)
+
+
+async def serve(args):
+    loop = asyncio.get_running_loop()
+    logger = Logger("{0}.txt".format(args.session))
+    recorder = SessionRecorder("{0}.ndjson".format(args.session),
+                               args.session)
+    logger.log_info("Building asyncio server, shape file {0}".format(
+        args.shapes_file))
+    library = order_by(load_library(args.shapes_file), args.round_order)
+    journal = None
+    if args.journal_interval > 0:
+        journal = SessionJournal("{0}.journal".format(args.session),
+                                 len(library))
+    factory = AsyncioLobby(loop, library, logger, args.stats_interval,
+                           args.tick_rate, args.sweep, recorder,
+                           args.ping_interval, journal, args.journal_interval,
+                           args.reconnect_window, args.resume_wait)
+    server = await loop.create_server(lambda: AsyncioConnection(factory),
+                                      port=args.port)
+    logger.log_info("Server started on port {0}".format(args.port))
+
+    stopped = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopped.set)
+    try:
+        await stopped.wait()
+    finally:
+        server.close()
+        factory.stop()
+        await server.wait_closed()
+        recorder.stop()
+        logger.stop()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.uvloop:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    asyncio.run(serve(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""
+Server side of the game protocol without any networking: ServerConnection
+handles the received lines and writes its messages through write(), so the
+same state machine runs on the Twisted reactor (game_server.py) and on
+asyncio (aio_server.py).
+"""
+import json
+import time
+from math import ceil
+
+from common import codec
+from latency import LatencyHistogram
+
+
+class ServerConnection(object):
+    """
+    ServerConnection manages a single client connection. Subclasses
+    implement write() and disconnect() and call lineReceived() with every
+    received line.
+
+    Posible states:
+        * WAIT -- connection established, waiting for "ready" message
+        * READY -- client ready for game start
+        * GAME -- client during gameplay
+    """
+    # As in LineReceiver, which Twisted connections also inherit from.
+    delimiter = b"\r\n"
+    MAX_LENGTH = 16384
+
+    def __init__(self):
+        self.factory = None
+        self.room = None
+        self.name = None
+        self.features = set()
+        # shapes_hash of the round a reconnecting client was playing
+        self.shapes_hash = None
+        self.ping_seq = 0
+        # Round trip times of server pings and move delays from the client
+        # timestamp, available with the time feature.
+        self.rtt = LatencyHistogram()
+        self.uplink = LatencyHistogram()
+
+    def write(self, data):
+        raise NotImplementedError
+
+    def disconnect(self):
+        raise NotImplementedError
+
+    def connectionMade(self):
+        self.factory.clients.append(self)
+        self.state = "WAIT"
+
+    def lineReceived(self, line):
+        """
+        Main protocol logic. In state WAIT server accepts only "ready"
+        message, which also places the client in a room. When both players
+        in a room are READY game starts. Messages from client after login are
+        interpreted as compressed objects representing player moves.
+        """
+        line = line.decode("utf-8")
+        if line[:4] == codec.PING:
+            self.sendLine(codec.encode_pong(line, time.time()))
+        elif line[:4] == codec.PONG:
+            _, sent, _ = codec.decode_pong(line)
+            self.rtt.add(time.time() - sent)
+        elif self.state == "WAIT":
+            if line[:5] == codec.PROTO:
+                self.set_features(codec.decode_proto(line))
+            elif line[:4] == codec.HAVE:
+                self.shapes_hash = codec.decode_have(line)
+            elif line[:5] == "ready":
+                self.set_ready()
+                self.name = line[6:]
+                if self.room is None:
+                    self.factory.join_room(self)
+                if self.room.all_ready():
+                    self.room.start_game()
+        elif self.state == "GAME":
+            pos, seq, sent = codec.decode_move(line)
+            if sent is not None:
+                self.uplink.add(max(time.time() - sent, 0.))
+            self.room.player_move(self.id, self.name, pos, seq, sent)
+
+    def sendLine(self, line):
+        """
+        Sends a line, returns the number of bytes written.
+        """
+        line = line.encode('utf-8') + self.delimiter
+        self.factory.bytes_written += len(line)
+        self.write(line)
+        return len(line)
+
+    def send_game_state(self, game_state):
+        """
+        Sends a game state as a sequence of JSON chunks, or as a single
+        frame to clients using the frame feature. Returns the number of
+        bytes written.
+        """
+        msg = json.dumps(game_state)
+        if codec.FRAME in self.features:
+            data = msg.encode('utf-8')
+            sent = self.sendLine(codec.encode_frame_header(len(data)))
+            self.write(data)
+            self.factory.bytes_written += len(data)
+            return sent + len(data)
+        sent = 0
+        for i in range(ceil(float(len(msg))/self.MAX_LENGTH)):
+            sent += self.sendLine(msg[i*self.MAX_LENGTH:(i+1)*self.MAX_LENGTH])
+        return sent + self.sendLine("json_end")
+
+    def send_players(self, players, changed, last_moves):
+        """
+        Sends player updates, delta clients get only the changed players.
+        last_moves holds the (seq, sent) of the last move of every player.
+        Returns the number of bytes written.
+        """
+        if codec.DELTA not in self.features:
+            return self.send_game_state({"players": players})
+        timed = codec.TIME in self.features
+        sent = 0
+        for player_id in changed:
+            seq, move_sent = last_moves[player_id] if timed else (None, None)
+            sent += self.sendLine(codec.encode_player(
+                player_id, players[player_id], seq, move_sent))
+        return sent
+
+    def send_ping(self):
+        if codec.TIME in self.features:
+            self.ping_seq += 1
+            self.sendLine(codec.encode_ping(self.ping_seq, time.time()))
+
+    def set_features(self, requested):
+        self.features = set(codec.negotiate(requested))
+        self.sendLine(codec.encode_proto(sorted(self.features)))
+
+    def connectionLost(self, reason):
+        self.factory.client_lost(self)
+
+    def set_ready(self):
+        self.state = "READY"
+
+    def set_wait(self):
+        self.state = "WAIT"
+        self.sendLine("reset")
+
+    def set_game(self, two_player_game):
+        self.state = "GAME"
+        self.sendLine("start {0} {1}".format(int(two_player_game), self.id))
+
+    def set_finished(self):
+        self.state = "FINISHED"
+        self.sendLine("finish")
@@ -0,0 +1,93 @@
+"""
+The game server on Twisted: the protocol state machine of connection.py
+and the rooms of lobby.py on a LineReceiver and a Factory, with the
+periodic tasks as LoopingCalls.
+"""
+from twisted.internet.protocol import Factory
+from twisted.internet.task import LoopingCall
+from twisted.protocols.basic import LineReceiver
+from twisted.web.resource import Resource
+
+from connection import ServerConnection
+from lobby import Lobby
+from metrics import exposition
+
+
+class GameServerProtocol(ServerConnection, LineReceiver):
+    """
+    GameServerProtocol runs a ServerConnection on a Twisted transport.
+    """
+
+    def dataReceived(self, data):
+        self.factory.bytes_received += len(data)
+        LineReceiver.dataReceived(self, data)
+
+    def write(self, data):
+        self.transport.write(data)
+
+    def disconnect(self):
+        if self.transport is not None:
+            self.transport.loseConnection()
+
+
+class GameServerFactory(Lobby, Factory):
+    """
+    GameServerFactory creates a GameServerProtocol for each new connection
+    and runs the Lobby timers on the reactor.
+    """
+
+    def __init__(self, library, logger, stats_interval=10., tick_rate=0,
+                 sweep=False, recorder=None, ping_interval=2., clock=None,
+                 journal=None, journal_interval=1., reconnect_window=0.,
+                 resume_wait=30.):
+        """
+        See Lobby, timers run on clock, by default the reactor.
+        """
+        super(GameServerFactory, self).__init__(
+            library, logger, stats_interval, tick_rate, sweep, recorder,
+            ping_interval, journal, journal_interval, reconnect_window,
+            resume_wait)
+        self.clock = clock
+        self.loops = []
+        for function, interval in self.timers():
+            loop = LoopingCall(function)
+            if clock is not None:
+                loop.clock = clock
+            if interval > 0:
+                loop.start(interval, now=False)
+            self.loops.append(loop)
+
+    def buildProtocol(self, addr):
+        protocol = GameServerProtocol()
+        protocol.factory = self
+        return protocol
+
+    def call_later(self, delay, function, *args):
+        clock = self.clock
+        if clock is None:
+            from twisted.internet import reactor as clock
+        return clock.callLater(delay, function, *args)
+
+    def stop(self):
+        for loop in self.loops:
+            if loop.running:
+                loop.stop()
+        super(GameServerFactory, self).stop()
+
+
+class MetricsResource(Resource):
+    """
+    Serves the exposition of the factory at /metrics.
+    """
+    isLeaf = True
+
+    def __init__(self, factory):
+        Resource.__init__(self)
+        self.factory = factory
+
+    def render_GET(self, request):
+        if request.path != b"/metrics":
+            request.setResponseCode(404)
+            return b"not found\n"
+        request.setHeader(b"content-type", b"text/plain; version=0.0.4")
+        return exposition(self.factory).encode("utf-8")
@@ -0,0 +1,167 @@
+"""
+Headless game server, runs GameServerFactory on a plain Twisted reactor
+without Kivy.
+
+    python headless.py --session XXX --port 8000 --shapes-file shape_library.json
+
+Defaults can also be read from the [config] section of an ini file, such as
+the gameserver.ini written by the GUI server. With --workers N the rooms are
+spread over N worker processes, see sharded.py.
+"""
+import argparse
+import configparser
+import os
+import sys
+
+# the repository root, holding the shared common package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+from twisted.internet import reactor
+from twisted.web.server import Site
+
+from game_server import GameServerFactory, MetricsResource
+from library import load_library, order_by
+from logger import Logger
+from profiling import SnapshotProfiler, StageTimer, instrument_server
+from journal import SessionJournal
+from recorder import SessionRecorder
+
+DEFAULTS = {
+    'port': '8000',
+    'shapes_file': 'shape_library.json',
+    'session': 'XXX',
+    'stats_interval': '10',
+    'tick_rate': '0',
+    'sweep': '0',
+    'round_order': '',
+    'ping_interval': '2',
+    'metrics_port': '0',
+    'profile': '0',
+    'profile_seconds': '10',
+    'workers': '1',
+    'journal_interval': '1',
+    'reconnect_window': '10',
+    'resume_wait': '30',
+}
+
+
+def parse_args(argv=None):
+    pre_parser = argparse.ArgumentParser(add_help=False)
+    pre_parser.add_argument("--config", help="ini file with a [config] "
+                            "section providing defaults")
+    known, _ = pre_parser.parse_known_args(argv)
+
+    config = configparser.ConfigParser()
+    config.read_dict({'config': DEFAULTS})
+    if known.config is not None:
+        config.read(known.config)
+    section = config['config']
+
+    parser = argparse.ArgumentParser(description="Headless Shape Samurai "
+                                     "server", parents=[pre_parser])
+    parser.add_argument("--port", type=int, default=section.getint('port'))
+    parser.add_argument("--shapes-file", default=section.get('shapes_file'))
+    parser.add_argument("--session", default=section.get('session'),
+                        help="session name, the log is written to "
+                        "<session>.txt")
+    parser.add_argument("--stats-interval", type=float,
+                        default=section.getfloat('stats_interval'),
+                        help="seconds between throughput reports, "
+                        "0 disables them")
+    parser.add_argument("--tick-rate", type=float,
+                        default=section.getfloat('tick_rate'),
+                        help="maximum broadcasts per second in a room, "
+                        "0 broadcasts every move")
+    parser.add_argument("--sweep", action="store_true",
+                        default=section.getboolean('sweep'),
+                        help="advance progress over all points swept by a "
+                        "move instead of only the next one")
+    parser.add_argument("--round-order", default=section.get('round_order'),
+                        help="order rounds by ascending difficulty feature, "
+                        "e.g. turning_mean, by default the library order")
+    parser.add_argument("--ping-interval", type=float,
+                        default=section.getfloat('ping_interval'),
+                        help="seconds between pings of clients using the "
+                        "time feature, 0 disables them")
+    parser.add_argument("--metrics-port", type=int,
+                        default=section.getint('metrics_port'),
+                        help="serve Prometheus metrics at "
+                        "http://<host>:<port>/metrics, 0 disables them")
+    parser.add_argument("--profile", action="store_true",
+                        default=section.getboolean('profile'),
+                        help="time the hot path stages and write a cProfile "
+                        "snapshot to <session>-<n>.pstats on SIGUSR1")
+    parser.add_argument("--profile-seconds", type=float,
+                        default=section.getfloat('profile_seconds'),
+                        help="duration of a profile snapshot")
+    parser.add_argument("--workers", type=int,
+                        default=section.getint('workers'),
+                        help="worker processes, more than one starts the "
+                        "sharded server")
+    parser.add_argument("--journal-interval", type=float,
+                        default=section.getfloat('journal_interval'),
+                        help="seconds between writes of the session journal "
+                        "<session>.journal letting returning pairs resume, "
+                        "0 disables it")
+    parser.add_argument("--reconnect-window", type=float,
+                        default=section.getfloat('reconnect_window'),
+                        help="seconds a room keeps running for a "
+                        "disconnected player to return, 0 closes it at once")
+    parser.add_argument("--resume-wait", type=float,
+                        default=section.getfloat('resume_wait'),
+                        help="seconds a journaled player waits for the "
+                        "partner to resume with before joining a new pair, "
+                        "0 disables resuming")
+    return parser.parse_args(argv)
+
+
+def build_server(args, session, metrics_port=0):
+    """
+    Creates the logger, recorder, journal and factory of a server writing
+    <session>.txt, <session>.ndjson and <session>.journal, stopped on
+    reactor shutdown.
+    """
+    logger = Logger("{0}.txt".format(session))
+    recorder = SessionRecorder("{0}.ndjson".format(session), session)
+    logger.log_info("Building headless server, shape file {0}".format(
+        args.shapes_file))
+
+    library = order_by(load_library(args.shapes_file), args.round_order)
+    journal = None
+    if args.journal_interval > 0:
+        journal = SessionJournal("{0}.journal".format(session), len(library))
+    factory = GameServerFactory(library, logger,
+                                args.stats_interval, args.tick_rate,
+                                args.sweep, recorder, args.ping_interval,
+                                journal=journal,
+                                journal_interval=args.journal_interval,
+                                reconnect_window=args.reconnect_window,
+                                resume_wait=args.resume_wait)
+    if args.profile:
+        timer = StageTimer()
+        instrument_server(timer)
+        SnapshotProfiler(session, timer, logger,
+                         args.profile_seconds).install()
+    if metrics_port:
+        reactor.listenTCP(metrics_port, Site(MetricsResource(factory)))
+    reactor.addSystemEventTrigger("before", "shutdown", factory.stop)
+    reactor.addSystemEventTrigger("after", "shutdown", recorder.stop)
+    reactor.addSystemEventTrigger("after", "shutdown", logger.stop)
+    return factory, logger
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.workers > 1:
+        from sharded import serve
+        serve(args)
+        return
+    factory, logger = build_server(args, args.session, args.metrics_port)
+    reactor.listenTCP(args.port, factory)
+    logger.log_info("Server started on port {0}".format(args.port))
+    reactor.run()
+
+
+if __name__ == '__main__':
+    main()
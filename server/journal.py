@@ -0,0 +1,118 @@
+import json
+import os
+
+
+class SessionJournal(object):
+    """
+    SessionJournal keeps the progress of every pair of players, identified
+    by their sorted names, in an append-only NDJSON file:
+
+        {"journal": 1, "rounds": number of rounds in the library}
+        {"pair": [name_a, name_b], "round": index}
+        {"pair": [name_a, name_b], "round": index, "players": players}
+
+    The first kind marks the round a pair plays next, the second snapshots
+    the progress of a round being played. The latest record of a pair wins,
+    so the file is compacted to one record per pair once it holds more than
+    compact_every records. A torn last line from a crash is dropped on load.
+    Records are buffered and written to disk by flush.
+    """
+    VERSION = 1
+
+    def __init__(self, filename, rounds, compact_every=10000):
+        self.filename = filename
+        self.rounds = rounds
+        self.compact_every = compact_every
+        self.pairs = {}
+        self.partners = {}
+        self.records = 0
+        clean = self.load()
+        self.file = open(filename, "a")
+        if not clean:
+            self.compact()
+
+    def load(self):
+        """
+        Reads the existing journal, returns False if it needs rewriting.
+        """
+        if not os.path.exists(self.filename):
+            return False
+        with open(self.filename) as f:
+            lines = f.read().split("\n")
+        clean = lines[-1] == ""
+        for line in filter(None, lines):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                return False
+            if "journal" in record:
+                if (record["journal"] != self.VERSION
+                        or record["rounds"] != self.rounds):
+                    self.pairs = {}
+                    self.partners = {}
+                    return False
+            else:
+                self.apply(record)
+            self.records += 1
+        return clean and self.records > 0
+
+    def apply(self, record):
+        pair = tuple(record["pair"])
+        self.pairs[pair] = (record["round"], record.get("players"))
+        for name, partner in (pair, pair[::-1]):
+            self.partners[name] = partner
+
+    def write(self, record):
+        self.apply(record)
+        self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self.records += 1
+
+    def set_round(self, pair, index):
+        self.write({"pair": list(pair), "round": index})
+
+    def snapshot(self, pair, index, players):
+        self.write({"pair": list(pair), "round": index, "players": players})
+
+    def resume_point(self, name):
+        """
+        Returns (partner, round, players) for the unfinished session of the
+        player, players being None when the round has not been played yet.
+        Returns None without one.
+        """
+        partner = self.partners.get(name)
+        if partner is None:
+            return None
+        index, players = self.pairs[tuple(sorted((name, partner)))]
+        if index >= self.rounds:
+            return None
+        return partner, index, players
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        if self.records > max(self.compact_every, 2 * len(self.pairs)):
+            self.compact()
+
+    def compact(self):
+        """
+        Rewrites the journal with the latest record of every pair.
+        """
+        temporary = self.filename + ".tmp"
+        with open(temporary, "w") as f:
+            f.write(json.dumps({"journal": self.VERSION,
+                                "rounds": self.rounds}) + "\n")
+            for pair, (index, players) in self.pairs.items():
+                record = {"pair": list(pair), "round": index}
+                if players is not None:
+                    record["players"] = players
+                f.write(json.dumps(record, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.file.close()
+        os.replace(temporary, self.filename)
+        self.file = open(self.filename, "a")
+        self.records = len(self.pairs) + 1
+
+    def close(self):
+        self.flush()
+        self.file.close()
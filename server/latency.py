@@ -0,0 +1,59 @@
+from bisect import bisect_left
+
+
+class LatencyHistogram(object):
+    """
+    Rolling latency histogram with fixed buckets. Samples go to the current
+    window, rotate moves it to the previous one, so counts cover the last one
+    to two rotation intervals.
+    """
+    # Upper bucket bounds in seconds, the last bucket is unbounded.
+    BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1., 2.)
+
+    def __init__(self):
+        self.current = [0] * (len(self.BOUNDS) + 1)
+        self.previous = [0] * (len(self.BOUNDS) + 1)
+
+    def add(self, seconds):
+        self.current[bisect_left(self.BOUNDS, seconds)] += 1
+
+    def merge(self, other):
+        for i, (current, previous) in enumerate(zip(other.current,
+                                                    other.previous)):
+            self.current[i] += current
+            self.previous[i] += previous
+
+    def rotate(self):
+        self.previous = self.current
+        self.current = [0] * (len(self.BOUNDS) + 1)
+
+    def counts(self):
+        return [c + p for c, p in zip(self.current, self.previous)]
+
+    def percentile(self, q):
+        """
+        Upper bound of the bucket holding the q-th percentile, None without
+        samples.
+        """
+        counts = self.counts()
+        total = sum(counts)
+        if total == 0:
+            return None
+        rank = q / 100. * total
+        seen = 0
+        for bound, count in zip(self.BOUNDS + (float("inf"),), counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def summary(self):
+        """
+        Returns a text like "n=120 p50<=20ms p90<=50ms p99<=100ms".
+        """
+        total = sum(self.counts())
+        if total == 0:
+            return "n=0"
+        return "n={0} {1}".format(total, " ".join(
+            "p{0}<={1:g}ms".format(q, 1000. * self.percentile(q))
+            for q in (50, 90, 99)))
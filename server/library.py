@@ -0,0 +1,279 @@
+"""
+Shape libraries. The JSON library lists rounds as (shape_a, shape_b,
+two_player_game) tuples of polygon vertices and is interpolated at every
+round start. It can be compiled offline into a memory-mappable binary file
+holding interpolated shapes and their lengths:
+
+    python library.py shape_library.json
+
+writes shape_library.bin, which load_library picks up as long as its content
+hash matches the JSON file.
+
+Compiling also stores the difficulty features of shapes.shape_features for
+every shape, so rounds can be ordered by difficulty without computing
+anything at session time, and the codec.shapes_hash of every round.
+
+Binary layout: 8 byte magic, little endian uint64 header length, JSON header
+describing the arrays, then the arrays, each aligned to ALIGNMENT bytes.
+"""
+import argparse
+import hashlib
+import json
+import os
+import struct
+import sys
+
+import numpy as np
+
+if __name__ == '__main__':
+    # run as a script: the repository root holds the common package
+    sys.path.insert(0, os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from common import codec, shapes
+from common.game_state import GameState
+
+MAGIC = b"SSAMLIB1"
+ALIGNMENT = 64
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def compiled_path(shapes_file):
+    return os.path.splitext(shapes_file)[0] + ".bin"
+
+
+def round_hash(points_a, points_b):
+    return codec.shapes_hash([points_a.tolist(), points_b.tolist()])
+
+
+class JsonLibrary(object):
+    """
+    Rounds read from the JSON shape library, interpolated on demand.
+    """
+
+    def __init__(self, rounds):
+        self.rounds = rounds
+        self.hashes = {}
+
+    def __len__(self):
+        return len(self.rounds)
+
+    def game_state(self, index, sweep=False):
+        shape_a, shape_b, two_player_game = self.rounds[index]
+        return GameState(shape_a, shape_b, two_player_game, sweep)
+
+    def shapes_hash(self, index):
+        """
+        Returns the codec.shapes_hash of a round, computed once.
+        """
+        if index not in self.hashes:
+            self.hashes[index] = round_hash(
+                *[shapes.interpolate_shape(verts)
+                  for verts in self.rounds[index][:2]])
+        return self.hashes[index]
+
+    def round_feature(self, name):
+        """
+        Returns the feature of every round, the larger of its two shapes.
+        """
+        features = [shapes.shape_features([r[i] for r in self.rounds],
+                                          GameState.RADIUS)[name]
+                    for i in (0, 1)]
+        return np.maximum(*features)
+
+
+class ShapeLibrary(object):
+    """
+    Compiled shape library. Arrays are views of the memory-mapped file, so
+    a round lookup copies nothing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.data = np.memmap(path, dtype=np.uint8, mode="r")
+        if bytes(self.data[:len(MAGIC)]) != MAGIC:
+            raise ValueError("{0} is not a compiled shape library".format(
+                path))
+        header_length, = struct.unpack_from("<Q", self.data, len(MAGIC))
+        start = len(MAGIC) + 8
+        self.header = json.loads(
+            bytes(self.data[start:start + header_length]).decode("utf-8"))
+        for name, spec in self.header["arrays"].items():
+            setattr(self, name, np.ndarray(tuple(spec["shape"]),
+                                           dtype=spec["dtype"],
+                                           buffer=self.data,
+                                           offset=spec["offset"]))
+
+    def __len__(self):
+        return len(self.rounds)
+
+    def points(self, shape_index):
+        start, end = self.offsets[shape_index:shape_index + 2]
+        return self.shape_points[start:end]
+
+    def game_state(self, index, sweep=False):
+        shape_a, shape_b, two_player_game = self.rounds[index]
+        return GameState.from_points(self.points(shape_a),
+                                     self.points(shape_b),
+                                     bool(two_player_game), sweep)
+
+    def shapes_hash(self, index):
+        return self.round_hashes[index].decode("ascii")
+
+    def round_feature(self, name):
+        """
+        Returns the feature of every round, the larger of its two shapes.
+        """
+        feature = getattr(self, "feature_" + name, None)
+        if feature is None:
+            raise ValueError("{0} has no feature {1}, recompile it".format(
+                self.path, name))
+        return np.maximum(feature[self.rounds[:, 0]],
+                          feature[self.rounds[:, 1]])
+
+    def is_current(self, source_hash):
+        return (self.header["source_hash"] == source_hash
+                and self.header["density"] == shapes.DENSITY
+                and self.header["radius"] == GameState.RADIUS
+                and "round_hashes" in self.header["arrays"])
+
+
+class OrderedLibrary(object):
+    """
+    Presents the rounds of a library in the given order.
+    """
+
+    def __init__(self, library, order):
+        self.library = library
+        self.order = [int(index) for index in order]
+
+    def __len__(self):
+        return len(self.order)
+
+    def game_state(self, index, sweep=False):
+        return self.library.game_state(self.order[index], sweep)
+
+    def shapes_hash(self, index):
+        return self.library.shapes_hash(self.order[index])
+
+
+def order_by(library, feature):
+    """
+    Orders the rounds by ascending feature, e.g. "turning_mean".
+    """
+    if not feature or len(library) == 0:
+        return library
+    return OrderedLibrary(library,
+                          np.argsort(library.round_feature(feature),
+                                     kind="stable"))
+
+
+def compile_library(rounds, path, source_hash):
+    """
+    Interpolates every distinct shape of the rounds once and writes the
+    compiled library to path.
+    """
+    shape_ids = {}
+    polygons = []
+    round_table = []
+    for shape_a, shape_b, two_player_game in rounds:
+        ids = []
+        for verts in (shape_a, shape_b):
+            key = json.dumps(verts)
+            if key not in shape_ids:
+                shape_ids[key] = len(polygons)
+                polygons.append(verts)
+            ids.append(shape_ids[key])
+        round_table.append(ids + [int(two_player_game)])
+
+    interpolated = [shapes.interpolate_shape(verts) for verts in polygons]
+    counts = [len(points) for points in interpolated]
+    hashes = [round_hash(interpolated[a], interpolated[b])
+              for a, b, _ in round_table]
+    shape_points = (np.concatenate(interpolated) if interpolated
+                    else np.zeros((0, 2)))
+    arrays = {
+        "shape_points": shape_points,
+        "offsets": np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+        "lengths": np.array([shapes.shape_length(points)
+                             for points in interpolated], dtype=np.float64),
+        "rounds": np.array(round_table, dtype=np.int64).reshape(-1, 3),
+        "round_hashes": np.array(hashes, dtype="S16"),
+    }
+    for name, values in shapes.shape_features(polygons,
+                                              GameState.RADIUS).items():
+        arrays["feature_" + name] = values
+    write_arrays(path, arrays, {"source_hash": source_hash,
+                                "density": shapes.DENSITY,
+                                "radius": GameState.RADIUS})
+
+
+def write_arrays(path, arrays, header):
+    """
+    Writes arrays in the compiled library layout, header gets the array
+    descriptions added.
+    """
+    # Offsets depend on the header length, which depends on the offsets;
+    # reserve room for the largest offsets before laying out the arrays.
+    header = dict(header, arrays={
+        name: {"dtype": array.dtype.str, "shape": list(array.shape),
+               "offset": 10 ** 15} for name, array in arrays.items()})
+    header_length = len(json.dumps(header).encode("utf-8"))
+    offset = len(MAGIC) + 8 + header_length
+    for name, array in arrays.items():
+        offset += -offset % ALIGNMENT
+        header["arrays"][name]["offset"] = offset
+        offset += array.nbytes
+    encoded = json.dumps(header).encode("utf-8")
+    encoded += b" " * (header_length - len(encoded))
+
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(encoded)))
+        f.write(encoded)
+        for name, array in arrays.items():
+            f.write(b"\0" * (header["arrays"][name]["offset"] - f.tell()))
+            f.write(np.ascontiguousarray(array).tobytes())
+
+
+def load_library(shapes_file):
+    """
+    Loads the shape library, preferring an up to date compiled library.
+    A missing file gives an empty library.
+    """
+    if shapes_file.endswith(".bin"):
+        return ShapeLibrary(shapes_file)
+    try:
+        with open(shapes_file, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return JsonLibrary([])
+    if os.path.exists(compiled_path(shapes_file)):
+        library = ShapeLibrary(compiled_path(shapes_file))
+        if library.is_current(content_hash(data)):
+            return library
+    return JsonLibrary(json.loads(data.decode("utf-8")))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile a JSON shape "
+                                     "library into the binary format")
+    parser.add_argument("shapes_file")
+    parser.add_argument("-o", "--output", help="defaults to the shapes file "
+                        "with a .bin extension")
+    args = parser.parse_args(argv)
+
+    with open(args.shapes_file, "rb") as f:
+        data = f.read()
+    output = args.output or compiled_path(args.shapes_file)
+    compile_library(json.loads(data.decode("utf-8")), output,
+                    content_hash(data))
+    print("Compiled {0} rounds into {1}".format(len(ShapeLibrary(output)),
+                                                 output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,301 @@
+"""
+Connection and room bookkeeping of the game server without any networking:
+Lobby pairs the ServerConnection objects of connection.py into rooms,
+collects stats and journals progress. game_server.py runs it on the
+Twisted reactor, aio_server.py on asyncio.
+"""
+import time
+from collections import Counter
+from itertools import count
+
+from latency import LatencyHistogram
+from metrics import Histogram
+from room import Room
+
+
+class Lobby(object):
+    """
+    Lobby keeps track of active connections and rooms. Clients are paired
+    into rooms in the order in which they report ready. Subclasses run the
+    periodic tasks returned by timers() and implement call_later().
+    """
+
+    def __init__(self, library, logger, stats_interval=10., tick_rate=0,
+                 sweep=False, recorder=None, ping_interval=2., journal=None,
+                 journal_interval=1., reconnect_window=0., resume_wait=30.):
+        """
+        With a positive tick_rate room broadcasts are limited to tick_rate
+        frames per second, otherwise every move is broadcast immediately.
+        sweep selects the sweep progress mode of GameState. Moves are written
+        to the recorder, a SessionRecorder, if given. Clients using the time
+        feature are pinged every ping_interval seconds.
+
+        With a journal, a SessionJournal, the progress of every room is
+        snapshotted every journal_interval seconds, and players returning
+        with the name of an unfinished pair are placed in a room resuming
+        it, waiting resume_wait seconds for their partner before joining
+        the open room instead. A resume_wait of 0 disables resuming.
+
+        A client disconnected from a full room is detached for
+        reconnect_window seconds, the room keeps running and the client
+        rejoins it if it reports ready under the same name in time. Without
+        a window, or once it passes, the room is closed.
+        """
+        self.library = library
+        self.logger = logger
+        self.recorder = recorder
+        self.journal = journal
+        self.reconnect_window = reconnect_window
+        self.resume_wait = resume_wait
+        self.tick_rate = tick_rate
+        self.sweep = sweep
+        self.stats_interval = stats_interval
+        self.ping_interval = ping_interval
+        self.journal_interval = journal_interval
+        self.clients = []
+        self.rooms = {}
+        self.open_room = None
+        self.room_ids = count()
+        # (room, expiry call) of resumed pairs by the name of the partner
+        # they wait for
+        self.waiting = {}
+        # (room, expiry call) of detached clients by name
+        self.detached = {}
+
+        self.totals = {"moves": 0, "broadcasts": 0, "bytes_sent": 0,
+                       "resets": 0}
+        # Transport level byte counts and GameState.update durations, see
+        # metrics.exposition.
+        self.bytes_received = 0
+        self.bytes_written = 0
+        self.update_times = Histogram()
+        self.merged = Counter()
+        self.last_report = (time.time(), dict(self.totals), {})
+
+    def timers(self):
+        """
+        Returns the (function, interval) of the periodic tasks, an interval
+        of 0 disables the task.
+        """
+        return ((self.report_stats, self.stats_interval),
+                (self.tick, 1. / self.tick_rate if self.tick_rate > 0 else 0),
+                (self.ping_clients, self.ping_interval),
+                (self.snapshot_rooms,
+                 self.journal_interval if self.journal else 0))
+
+    def call_later(self, delay, function, *args):
+        """
+        Calls function(*args) after delay seconds, returns an object with
+        a cancel() method.
+        """
+        raise NotImplementedError
+
+    def new_room(self):
+        room_id = next(self.room_ids)
+        room_logger = self.logger.child("room{0}".format(room_id))
+        room = Room(room_id, self.library, room_logger,
+                    coalesce=self.tick_rate > 0, sweep=self.sweep,
+                    recorder=self.recorder, update_times=self.update_times,
+                    journal=self.journal)
+        self.rooms[room_id] = room
+        return room
+
+    def join_room(self, client):
+        """
+        Returns a reconnecting client to its room, otherwise places the
+        client in the room of its journaled pair if it has one, or in the
+        room waiting for a partner, opening a new room if there is none.
+        """
+        if client.name in self.detached:
+            room, expiry = self.detached.pop(client.name)
+            expiry.cancel()
+            room.rejoin(client)
+            return room
+        if client.name in self.waiting:
+            room, expiry = self.waiting.pop(client.name)
+            expiry.cancel()
+            room.add_client(client)
+            return room
+        if self.journal is not None and self.resume_wait > 0:
+            resume = self.journal.resume_point(client.name)
+            if resume is not None:
+                partner, index, players = resume
+                room = self.new_room()
+                room.resume(index, players)
+                room.add_client(client)
+                self.waiting[partner] = (room, self.call_later(
+                    self.resume_wait, self.resume_expired, partner))
+                self.logger.log_info("{0} resumes round {1}, waiting for "
+                                     "{2} in room {3}".format(
+                                         client.name, index, partner,
+                                         room.id))
+                return room
+        return self.join_open_room(client)
+
+    def join_open_room(self, client):
+        if self.open_room is None:
+            self.open_room = self.new_room()
+        room = self.open_room
+        room.add_client(client)
+        if room.is_full():
+            self.open_room = None
+        return room
+
+    def resume_expired(self, partner):
+        """
+        Moves a player whose partner did not return to the open room.
+        """
+        room, _ = self.waiting.pop(partner)
+        self.rooms.pop(room.id, None)
+        client = room.clients[0]
+        room.clients = []
+        room.logger.log_info("{0} did not return, {1} joins a new "
+                             "pair".format(partner, client.name))
+        room = self.join_open_room(client)
+        if room.all_ready():
+            room.start_game()
+
+    def close_room(self, room):
+        if self.rooms.pop(room.id, None) is None:
+            return
+        if self.open_room is room:
+            self.open_room = None
+        for name, (waiting, expiry) in list(self.waiting.items()):
+            if waiting is room:
+                expiry.cancel()
+                del self.waiting[name]
+        for name, (detached, expiry) in list(self.detached.items()):
+            if detached is room:
+                expiry.cancel()
+                del self.detached[name]
+        room.journal_snapshot()
+        for key in self.totals:
+            self.totals[key] += getattr(room, key)
+        self.merged.update(room.merged)
+        room.close()
+        self.logger.log_info("Room {0} closed".format(room.id))
+
+    def client_lost(self, client):
+        if client in self.clients:
+            self.clients.remove(client)
+        room = client.room
+        if room is None:
+            return
+        if (self.reconnect_window > 0 and room.is_full()
+                and client.state != "FINISHED"
+                and client.name not in self.detached):
+            room.detach(client)
+            self.detached[client.name] = (room, self.call_later(
+                self.reconnect_window, self.reconnect_expired, client.name))
+        else:
+            self.close_room(room)
+
+    def reconnect_expired(self, name):
+        room, _ = self.detached.pop(name)
+        room.logger.log_info("{0} did not reconnect".format(name))
+        self.close_room(room)
+
+    def ping_clients(self):
+        for client in self.clients:
+            client.send_ping()
+
+    def latency_stats(self):
+        """
+        Returns {room id: (rtt, uplink)} histograms merged over the clients
+        of every room.
+        """
+        stats = {}
+        for room in self.rooms.values():
+            rtt, uplink = LatencyHistogram(), LatencyHistogram()
+            for client in room.clients:
+                rtt.merge(client.rtt)
+                uplink.merge(client.uplink)
+            stats[room.id] = (rtt, uplink)
+        return stats
+
+    def snapshot_rooms(self):
+        """
+        Journals the progress of every room and writes the journal to disk.
+        """
+        for room in self.rooms.values():
+            room.journal_snapshot()
+        self.journal.flush()
+
+    def tick(self):
+        for room in self.rooms.values():
+            room.flush()
+
+    def stats(self):
+        """
+        Returns aggregate counters including closed rooms. "merged" maps
+        the number of moves merged into a frame to the number of such frames.
+        """
+        totals = dict(self.totals)
+        merged = Counter(self.merged)
+        for room in self.rooms.values():
+            for key in totals:
+                totals[key] += getattr(room, key)
+            merged.update(room.merged)
+        totals["merged"] = dict(merged)
+        if self.recorder is not None:
+            totals.update(self.recorder.stats())
+        totals["rooms"] = len(self.rooms)
+        totals["clients"] = len(self.clients)
+        return totals
+
+    def report_stats(self):
+        """
+        Logs per-room and aggregate throughput since the previous report.
+        """
+        now = time.time()
+        last_time, last_totals, last_rooms = self.last_report
+        elapsed = max(now - last_time, 1e-6)
+        rooms = {}
+        latency = self.latency_stats()
+        for room in self.rooms.values():
+            counters = (room.moves, room.broadcasts, room.bytes_sent)
+            prev = last_rooms.get(room.id, (0, 0, 0))
+            rooms[room.id] = counters
+            room.logger.log_info(
+                "moves/s: {0:.1f}, broadcasts/s: {1:.1f}, "
+                "bytes/s: {2:.0f}, moves per frame: {3}".format(
+                    *[(c - p) / elapsed for c, p in zip(counters, prev)],
+                    sorted(room.merged.items())))
+            rtt, uplink = latency[room.id]
+            room.logger.log_info("rtt: {0}, uplink: {1}".format(
+                rtt.summary(), uplink.summary()))
+            for client in room.clients:
+                room.logger.log_info(
+                    "client {0}-{1} rtt: {2}, uplink: {3}".format(
+                        client.id, client.name, client.rtt.summary(),
+                        client.uplink.summary()))
+                client.rtt.rotate()
+                client.uplink.rotate()
+        totals = self.stats()
+        self.logger.log_info(
+            "rooms: {0}, clients: {1}, moves/s: {2:.1f}, "
+            "broadcasts/s: {3:.1f}, bytes/s: {4:.0f}".format(
+                totals["rooms"], totals["clients"],
+                *[(totals[key] - last_totals[key]) / elapsed
+                  for key in ("moves", "broadcasts", "bytes_sent")]))
+        if self.recorder is not None:
+            self.logger.log_info(
+                "recorder queue: {0}, written: {1}, dropped: {2}".format(
+                    totals["recorder_queue"], totals["recorder_written"],
+                    totals["recorder_dropped"]))
+        self.last_report = (now, totals, rooms)
+
+    def reset_connections(self, *args):
+        """
+        Disconnects all clients, resets server to an initial state.
+        """
+        for room in list(self.rooms.values()):
+            self.close_room(room)
+        for client in self.clients:
+            client.disconnect()
+        self.clients = []
+
+    def stop(self):
+        self.reset_connections()
+        if self.journal is not None:
+            self.journal.close()
@@ -8,13 +8,8 @@ class Logger(object):
     def __init__(self, filename):
         log_format = logging.Formatter('[%(asctime)s] %(levelname)-4s '
                                        '%(name)-4s %(message)s')
-        log_format_default = ('[%(asctime)s] %(levelname)-4s %(name)-4s '
-                              '%(message)s')
-        logging.basicConfig(filename=filename,
-                            format=log_format_default,
-                            level=logging.INFO)
 
-        que = queue.Queue(-1)  # no limit on size
+        self.queue = que = queue.Queue(-1)  # no limit on size
         handler = logging.FileHandler(filename)
         handler.setFormatter(log_format)
         handler.setLevel(logging.INFO)
@@ -25,10 +20,36 @@ class Logger(object):
         queue_handler = logging.handlers.QueueHandler(que)
 
         self.root = logging.getLogger()
+        self.root.setLevel(logging.INFO)
         self.root.addHandler(queue_handler)
 
     def log_info(self, info):
         self.root.info(info)
 
+    def queue_size(self):
+        """
+        Number of records waiting for the file handler.
+        """
+        return self.queue.qsize()
+
+    def child(self, name):
+        """
+        Returns a logger writing through the same queue, records are tagged
+        with the given name.
+        """
+        return ChildLogger(logging.getLogger(name))
+
     def stop(self):
         self.listener.stop()
+
+
+class ChildLogger(object):
+    """
+    Named logger sharing the handlers of the session Logger.
+    """
+
+    def __init__(self, logger):
+        self.logger = logger
+
+    def log_info(self, info):
+        self.logger.info(info)
@@ -0,0 +1,86 @@
+"""
+Prometheus text exposition of the server counters, served from the game
+reactor by game_server.MetricsResource:
+
+    python headless.py --metrics-port 9100
+    curl localhost:9100/metrics
+
+Rates such as moves per second are left to the scraper, e.g.
+rate(samurai_moves_total[1m]). Collection only reads counters the server
+keeps anyway, plus one histogram observation per GameState.update.
+"""
+from bisect import bisect_left
+
+PREFIX = "samurai_"
+
+
+class Histogram(object):
+    """
+    Cumulative histogram with fixed upper bucket bounds, as exposed by
+    Prometheus. The last bucket is unbounded.
+    """
+    # GameState.update durations in seconds
+    UPDATE_BOUNDS = (1e-6, 2e-6, 5e-6, 1e-5, 2e-5, 5e-5, 1e-4, 2e-4, 5e-4,
+                     1e-3, 5e-3)
+
+    def __init__(self, bounds=UPDATE_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def lines(self, name):
+        lines = []
+        seen = 0
+        for bound, count in zip(self.bounds + ("+Inf",), self.counts):
+            seen += count
+            lines.append('{0}_bucket{{le="{1}"}} {2}'.format(name, bound,
+                                                             seen))
+        lines.append("{0}_sum {1!r}".format(name, self.sum))
+        lines.append("{0}_count {1}".format(name, seen))
+        return lines
+
+
+def metric(lines, name, kind, help_text, value):
+    lines.append("# HELP {0}{1} {2}".format(PREFIX, name, help_text))
+    lines.append("# TYPE {0}{1} {2}".format(PREFIX, name, kind))
+    lines.append("{0}{1} {2}".format(PREFIX, name, value))
+
+
+def exposition(factory):
+    """
+    Returns the metrics of a GameServerFactory in the text format.
+    """
+    stats = factory.stats()
+    lines = []
+    metric(lines, "connections", "gauge", "Open client connections.",
+           stats["clients"])
+    metric(lines, "rooms", "gauge", "Open rooms.", stats["rooms"])
+    metric(lines, "moves_total", "counter", "Moves applied.",
+           stats["moves"])
+    metric(lines, "broadcasts_total", "counter", "Frames broadcast to rooms.",
+           stats["broadcasts"])
+    metric(lines, "progress_resets_total", "counter",
+           "Progress resets after exceeding the progress margin.",
+           stats["resets"])
+    metric(lines, "received_bytes_total", "counter",
+           "Bytes received from clients.", factory.bytes_received)
+    metric(lines, "sent_bytes_total", "counter", "Bytes sent to clients.",
+           factory.bytes_written)
+    metric(lines, "logger_queue", "gauge", "Log records waiting to be "
+           "written.", factory.logger.queue_size())
+    if factory.recorder is not None:
+        metric(lines, "recorder_queue", "gauge", "Session records waiting "
+               "to be written.", stats["recorder_queue"])
+        metric(lines, "recorder_dropped_total", "counter",
+               "Session records dropped on a full queue.",
+               stats["recorder_dropped"])
+    name = PREFIX + "update_seconds"
+    lines.append("# HELP {0} GameState.update duration.".format(name))
+    lines.append("# TYPE {0} histogram".format(name))
+    lines.extend(factory.update_times.lines(name))
+    return "\n".join(lines) + "\n"
+
@@ -0,0 +1,138 @@
+"""
+Opt-in profiling of the server hot path.
+
+StageTimer wraps the hot path functions with timers aggregating call counts
+and total and maximum durations in-process. Nothing is wrapped unless
+instrument_server is called, so disabled profiling costs nothing. Stages
+nest: lineReceived includes decode_move, update, send_players and log.
+
+SnapshotProfiler runs cProfile for a few seconds on request and dumps the
+pstats file together with the stage timings, while the server keeps running:
+
+    python headless.py --session XXX --profile
+    kill -USR1 <pid>
+    python -m pstats XXX-1.pstats
+"""
+import cProfile
+import functools
+import signal
+import time
+
+from twisted.internet import reactor
+
+
+class StageTimer(object):
+    """
+    Aggregated [calls, total seconds, max seconds] of every stage.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.patched = []
+
+    def instrument(self, owner, attribute, stage):
+        """
+        Replaces owner.attribute, a module function or a method, by a timed
+        wrapper adding to the stage.
+        """
+        original = owner.__dict__[attribute]
+        stats = self.stages.setdefault(stage, [0, 0., 0.])
+        perf_counter = time.perf_counter
+
+        @functools.wraps(original)
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - start
+                stats[0] += 1
+                stats[1] += elapsed
+                if elapsed > stats[2]:
+                    stats[2] = elapsed
+
+        setattr(owner, attribute, timed)
+        self.patched.append((owner, attribute, original))
+
+    def remove(self):
+        """
+        Restores the original functions.
+        """
+        for owner, attribute, original in reversed(self.patched):
+            setattr(owner, attribute, original)
+        self.patched = []
+
+    def reset(self):
+        for stats in self.stages.values():
+            stats[:] = [0, 0., 0.]
+
+    def summary(self):
+        """
+        Returns one line per stage, slowest total first.
+        """
+        return ["{0}: {1} calls, total {2:.3f} s, mean {3:.1f} us, "
+                "max {4:.1f} us".format(name, calls, total,
+                                        1e6 * total / max(calls, 1),
+                                        1e6 * longest)
+                for name, (calls, total, longest) in sorted(
+                    self.stages.items(), key=lambda item: -item[1][1])]
+
+
+def instrument_server(timer):
+    """
+    Wraps the server hot path: line handling, move decoding, game state
+    updates, JSON and delta encoding, logging and recording.
+    """
+    from common import codec, game_state
+    import connection
+    import logger
+    import recorder
+
+    protocol = connection.ServerConnection
+    timer.instrument(protocol, "lineReceived", "lineReceived")
+    timer.instrument(codec, "decode_move", "decode_move")
+    timer.instrument(game_state.GameState, "update", "update")
+    timer.instrument(protocol, "send_game_state", "send_game_state")
+    timer.instrument(protocol, "send_players", "send_players")
+    timer.instrument(codec, "encode_player", "encode_player")
+    timer.instrument(logger.Logger, "log_info", "log")
+    timer.instrument(logger.ChildLogger, "log_info", "log")
+    timer.instrument(recorder.SessionRecorder, "put", "record")
+
+
+class SnapshotProfiler(object):
+    """
+    Profiles the reactor for duration seconds when triggered and writes
+    <prefix>-<n>.pstats, then logs and resets the stage timings.
+    """
+
+    def __init__(self, prefix, timer, logger, duration=10.):
+        self.prefix = prefix
+        self.timer = timer
+        self.logger = logger
+        self.duration = duration
+        self.profile = None
+        self.snapshots = 0
+
+    def install(self, signum=signal.SIGUSR1):
+        signal.signal(signum,
+                      lambda *args: reactor.callFromThread(self.start))
+
+    def start(self):
+        if self.profile is not None:
+            return
+        self.logger.log_info("Profiling for {0} s".format(self.duration))
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        reactor.callLater(self.duration, self.dump)
+
+    def dump(self):
+        self.profile.disable()
+        self.snapshots += 1
+        path = "{0}-{1}.pstats".format(self.prefix, self.snapshots)
+        self.profile.dump_stats(path)
+        self.profile = None
+        self.logger.log_info("Profile written to {0}".format(path))
+        for line in self.timer.summary():
+            self.logger.log_info(line)
+        self.timer.reset()
@@ -0,0 +1,110 @@
+import json
+import queue
+import threading
+import time
+
+
+class SessionRecorder(object):
+    """
+    SessionRecorder writes every move of a session once, as NDJSON records:
+
+        {"session": name, "t": start time, "version": 2}
+        {"t": time, "room": id, "round": index, "player": id,
+         "name": name, "x": x, "y": y, "progress": index}
+        {"t": time, "room": id, "round": index, "event": name}
+
+    Moves of clients using the time feature also have "seq", their
+    sequence number, and "delay", seconds from the client timestamp to the
+    server receiving the move. Events are "start", with "points", the
+    number of points of both shapes, "victory" and, since version 2,
+    "reset", recorded after the move which exceeded the progress margin.
+
+    The reactor only enqueues tuples, formatting and writing happen in
+    batches on a background thread. The queue is bounded, records which do
+    not fit are dropped and counted.
+    """
+
+    VERSION = 2
+
+    def __init__(self, filename, session, max_queue=100000, batch_size=1000,
+                 flush_interval=0.5):
+        self.queue = queue.Queue(max_queue)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+
+        self.file = open(filename, "a")
+        self.file.write(json.dumps({"session": session, "t": time.time(),
+                                    "version": self.VERSION}) + "\n")
+        self.thread = threading.Thread(target=self.run, name="recorder")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def record_move(self, room, round_index, player_id, name, pos, progress,
+                    seq=None, sent=None):
+        self.put((time.time(), room, round_index, player_id, name, pos[0],
+                  pos[1], progress, seq, sent))
+
+    def record_event(self, room, round_index, event, points=None):
+        self.put((time.time(), room, round_index, event, points))
+
+    def format(self, item):
+        if len(item) == 5:
+            t, room, round_index, event, points = item
+            record = {"t": t, "room": room, "round": round_index,
+                      "event": event}
+            if points is not None:
+                record["points"] = points
+        else:
+            (t, room, round_index, player_id, name, x, y, progress, seq,
+             sent) = item
+            record = {"t": t, "room": room, "round": round_index,
+                      "player": player_id, "name": name, "x": x, "y": y,
+                      "progress": progress}
+            if seq is not None:
+                record["seq"] = seq
+                record["delay"] = round(t - sent, 4)
+        return json.dumps(record, separators=(",", ":"))
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            try:
+                batch = [self.queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                stopping = True
+                batch = batch[:batch.index(None)]
+            if batch:
+                self.file.write("\n".join(map(self.format, batch)) + "\n")
+                self.file.flush()
+                self.written += len(batch)
+                self.batches += 1
+        self.file.close()
+
+    def stats(self):
+        return {"recorder_written": self.written,
+                "recorder_dropped": self.dropped,
+                "recorder_batches": self.batches,
+                "recorder_queue": self.queue.qsize()}
+
+    def stop(self):
+        """
+        Writes the remaining records and closes the file.
+        """
+        self.queue.put(None)
+        self.thread.join()
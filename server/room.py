@@ -0,0 +1,277 @@
+import time
+from collections import Counter
+
+from common import codec
+
+
+def snapshot(players):
+    return [[list(pos), progress] for pos, progress in players]
+
+
+class Room(object):
+    """
+    Room hosts a single pair of clients playing through the shape library.
+    Every room has its own game state, shape cursor and logger.
+
+    With coalesce set, moves are applied to the game state as they arrive
+    but broadcasting is left to flush, called on the server tick. With sweep
+    set, game states use the sweep progress mode. GameState.update
+    durations are observed by update_times, a metrics.Histogram, if given.
+
+    The round index and progress of the pair are kept in journal, a
+    SessionJournal, if given. A room created for a returning pair starts at
+    their journaled round and resumes the journaled progress, see resume.
+
+    A client which lost its connection may be detached instead of closing
+    the room: the round goes on for the partner and the client takes its
+    place back with rejoin.
+    """
+    SIZE = 2
+
+    def __init__(self, room_id, library, logger, coalesce=False,
+                 sweep=False, recorder=None, update_times=None,
+                 journal=None):
+        self.id = room_id
+        self.library = library
+        self.logger = logger
+        self.recorder = recorder
+        self.update_times = update_times
+        self.journal = journal
+        self.coalesce = coalesce
+        self.sweep = sweep
+        self.clients = []
+        self.current_shape = 0
+        self.round = None
+        self.game_state = None
+        self.shapes_hash = None
+        self.sent_players = None
+        # (seq, sent) of the last move of every player, see codec.TIME
+        self.last_moves = [(None, None), (None, None)]
+        # (round, players) to restore when that round starts, and the
+        # players last written to the journal
+        self.resumed = None
+        self.journaled = None
+        # ids of detached clients
+        self.absent = set()
+
+        # Throughput counters, read by GameServerFactory.report_stats.
+        self.moves = 0
+        self.broadcasts = 0
+        self.bytes_sent = 0
+        self.resets = 0
+        # Moves waiting for the next tick and the number of frames sent for
+        # each count of merged moves.
+        self.pending_moves = 0
+        self.merged = Counter()
+
+    def is_full(self):
+        return len(self.clients) >= self.SIZE
+
+    def add_client(self, client):
+        client.id = len(self.clients)
+        client.room = self
+        self.clients.append(client)
+
+    def pair(self):
+        return tuple(sorted(client.name for client in self.clients))
+
+    def resume(self, index, players):
+        """
+        Continues a journaled session at round index, with the players'
+        progress if the round was being played.
+        """
+        self.current_shape = index
+        if players is not None:
+            self.resumed = (index, players)
+
+    def all_ready(self):
+        return (self.is_full() and not self.absent
+                and all(client.state == "READY" for client in self.clients))
+
+    def present(self):
+        return [client for client in self.clients
+                if client.id not in self.absent]
+
+    def detach(self, client):
+        """
+        Keeps the place of a disconnected client for rejoin.
+        """
+        self.absent.add(client.id)
+        client.room = None
+        self.logger.log_info("{0} disconnected, waiting for "
+                             "reconnect".format(client.name))
+
+    def rejoin(self, client):
+        """
+        Gives a reconnected client the place of the detached client with its
+        name. During a round the client is started at once and resynced, see
+        start_message.
+        """
+        for player_id in self.absent:
+            if self.clients[player_id].name == client.name:
+                break
+        else:
+            raise ValueError("{0} is not detached".format(client.name))
+        self.absent.discard(player_id)
+        client.id = player_id
+        client.room = self
+        self.clients[player_id] = client
+        self.last_moves[player_id] = (None, None)
+        self.logger.log_info("{0} reconnected".format(client.name))
+        if self.game_state is None:
+            return
+        client.set_game(self.game_state.use_margin)
+        self.bytes_sent += client.send_game_state(self.start_message(
+            client.shapes_hash != self.shapes_hash))
+
+    def start_message(self, shapes=True):
+        """
+        Returns the game state sent on round start, or without the shapes
+        to resync a client which has them.
+        """
+        message = {"players": self.game_state.players, "sweep": self.sweep,
+                   codec.SHAPES_HASH: self.shapes_hash}
+        if shapes:
+            message["shapes"] = [shape.tolist()
+                                 for shape in self.game_state.shapes]
+        return message
+
+    def broadcast_game_state(self, game_state):
+        """
+        Broadcasts a game state to the connected clients in the room.
+        """
+        for client in self.present():
+            self.bytes_sent += client.send_game_state(game_state)
+        self.broadcasts += 1
+
+    def broadcast_players(self):
+        """
+        Broadcasts players which changed since the previous broadcast.
+        """
+        players = self.game_state.players
+        current = snapshot(players)
+        changed = [i for i, player in enumerate(current)
+                   if player != self.sent_players[i]]
+        for client in self.present():
+            self.bytes_sent += client.send_players(players, changed,
+                                                   self.last_moves)
+        self.broadcasts += 1
+        self.sent_players = current
+
+    def start_game(self):
+        clients = self.clients
+        if self.current_shape >= len(self.library):
+            for client in clients:
+                client.set_finished()
+            self.logger.log_info("Game finished")
+            return
+
+        if (clients[0].name > clients[1].name):
+            clients[0], clients[1] = clients[1], clients[0]
+            clients[0].id = 0
+            clients[1].id = 1
+
+        self.game_state = self.library.game_state(self.current_shape,
+                                                   self.sweep)
+        two_player_game = self.game_state.use_margin
+        self.round = self.current_shape
+        self.current_shape += 1
+        if self.recorder is not None:
+            self.recorder.record_event(
+                self.id, self.round, "start",
+                [len(shape) for shape in self.game_state.shapes])
+        self.journaled = None
+        if self.resumed is not None and self.resumed[0] == self.round:
+            for player, saved in zip(self.game_state.players,
+                                     self.resumed[1]):
+                player[:] = saved
+            self.logger.log_info("Resuming round {0}".format(self.round))
+            self.journaled = snapshot(self.game_state.players)
+        elif self.journal is not None:
+            self.journal.set_round(self.pair(), self.round)
+        self.resumed = None
+
+        self.shapes_hash = self.library.shapes_hash(self.round)
+        for client in clients:
+            client.set_game(two_player_game)
+        self.broadcast_game_state(self.start_message())
+        self.sent_players = snapshot(self.game_state.players)
+        self.last_moves = [(None, None), (None, None)]
+
+        self.logger.log_info("Game started, players {0}, shape {1}/{2}".format(
+            " ".join(client.name for client in clients),
+            self.current_shape, len(self.library)))
+
+    def player_move(self, player_id, player_name, move, seq=None,
+                    sent=None):
+        """
+        Applies a move, seq and sent are the client's move sequence number
+        and timestamp in server time if it uses the time feature.
+        """
+        if self.game_state is None:
+            return
+        self.moves += 1
+        self.last_moves[player_id] = (seq, sent)
+        resets = self.game_state.resets
+        if self.update_times is not None:
+            start = time.perf_counter()
+            finished = self.game_state.update(player_id, move)
+            self.update_times.observe(time.perf_counter() - start)
+        else:
+            finished = self.game_state.update(player_id, move)
+        self.resets += self.game_state.resets - resets
+        if self.recorder is not None:
+            self.recorder.record_move(self.id, self.round, player_id,
+                                      player_name, move,
+                                      self.game_state.players[player_id][1],
+                                      seq, sent)
+            if self.game_state.resets != resets:
+                self.recorder.record_event(self.id, self.round, "reset")
+        if finished:
+            self.game_victory()
+        elif self.coalesce:
+            self.pending_moves += 1
+        else:
+            self.broadcast_players()
+
+    def flush(self):
+        """
+        Broadcasts the players if any moves arrived since the last tick.
+        """
+        if self.pending_moves == 0 or self.game_state is None:
+            return
+        self.merged[self.pending_moves] += 1
+        self.pending_moves = 0
+        self.broadcast_players()
+
+    def journal_snapshot(self):
+        """
+        Writes the players to the journal if they changed since the last
+        snapshot.
+        """
+        if self.journal is None or self.game_state is None:
+            return
+        players = snapshot(self.game_state.players)
+        if players != self.journaled:
+            self.journal.snapshot(self.pair(), self.round, players)
+            self.journaled = players
+
+    def game_victory(self):
+        if self.journal is not None:
+            self.journal.set_round(self.pair(), self.round + 1)
+        self.game_state = None
+        self.pending_moves = 0
+        if self.recorder is not None:
+            self.recorder.record_event(self.id, self.round, "victory")
+        for client in self.present():
+            client.set_wait()
+
+    def close(self):
+        """
+        Disconnects both clients. The room cannot be reused afterwards.
+        """
+        for client in self.present():
+            client.room = None
+            client.disconnect()
+        self.clients = []
+        self.game_state = None
@@ -0,0 +1,411 @@
+"""
+Sharded headless server using all cores of a machine:
+
+    python headless.py --session XXX --port 8000 --workers 4
+
+A front process accepts connections on a plain socket and reads them up to
+the client's "ready <name>" line, then passes the socket and the bytes read
+so far to a worker process over a UNIX socket pair with SCM_RIGHTS. Workers
+adopt the sockets into their own Twisted reactor and run their own rooms,
+game states, logger, recorder and journal, writing <session>-w<n>.txt,
+<session>-w<n>.ndjson and <session>-w<n>.journal. With --metrics-port P
+worker n serves its metrics on P + n.
+
+Connections are routed by player name: a name in a room, or found in a
+worker journal, goes to the worker holding its room or journaled pair, so
+reconnects and resumed pairs find their room. Other names are paired in
+the order they report ready, every two on the same worker. Workers report
+the player waiting alone in their open room or for a journaled partner, so
+other names are sent to that player first, as the single process server
+would pair them, and the names of closed rooms which cannot be resumed,
+which the front then forgets. Connections which do not report ready within
+HANDSHAKE_TIMEOUT seconds, such as port probes, are closed without
+affecting the pairing.
+
+Workers report GameServerFactory.stats over the socket pair every stats
+interval, the front logs the rolled up stats to <session>.txt.
+"""
+import base64
+import json
+import multiprocessing
+import os
+import selectors
+import signal
+import socket
+import sys
+import time
+from collections import Counter
+
+from zope.interface import implementer
+
+from logger import Logger
+
+STATS = "stats"
+HANDOFF = "fd"
+OPEN = "open"
+CLOSED = "closed"
+# bytes and seconds a connection may take before "ready <name>"
+MAX_HANDSHAKE = 4096
+HANDSHAKE_TIMEOUT = 5.
+
+
+def rollup(worker_stats):
+    """
+    Sums the stats of all workers, "merged" histograms are merged.
+    """
+    totals = Counter()
+    merged = Counter()
+    for stats in worker_stats:
+        for key, value in stats.items():
+            if key == "merged":
+                merged.update({int(k): v for k, v in value.items()})
+            else:
+                totals[key] += value
+    totals = dict(totals)
+    totals["merged"] = dict(merged)
+    totals["workers"] = len(worker_stats)
+    return totals
+
+
+def journal_names(filename):
+    """
+    Returns the player names of the pairs in a journal file.
+    """
+    names = set()
+    if not os.path.exists(filename):
+        return names
+    with open(filename) as f:
+        for line in f:
+            try:
+                names.update(json.loads(line).get("pair", ()))
+            except ValueError:
+                break
+    return names
+
+
+def run_worker(index, channel, family, args):
+    """
+    Worker process: serves the connections received over channel.
+    """
+    from twisted.internet import reactor
+    from twisted.internet.interfaces import IFileDescriptorReceiver
+    from twisted.internet.protocol import Factory
+    from twisted.internet.task import LoopingCall
+    from twisted.protocols.basic import LineReceiver
+
+    from headless import build_server
+
+    @implementer(IFileDescriptorReceiver)
+    class WorkerChannel(LineReceiver):
+        """
+        Control connection to the front: adopts the client sockets it
+        passes, replaying the bytes the front read from them, and reports
+        stats, the player waiting in the open room and closed names.
+        """
+
+        def __init__(self, game_factory):
+            self.game_factory = game_factory
+            self.stats_loop = LoopingCall(self.send_stats)
+            self.fds = []
+            self.handoffs = 0
+
+        def connectionMade(self):
+            if args.stats_interval > 0:
+                self.stats_loop.start(args.stats_interval, now=False)
+
+        def fileDescriptorReceived(self, fd):
+            # delivered before the handoff line sent along with it
+            self.fds.append(fd)
+
+        def lineReceived(self, line):
+            line = line.decode("utf-8")
+            if line[:len(HANDOFF) + 1] != HANDOFF + " ":
+                return
+            fd = self.fds.pop(0)
+            try:
+                reactor.adoptStreamConnection(fd, family, self.game_factory)
+            finally:
+                os.close(fd)
+            # adopting calls connectionMade, which appends the protocol
+            protocol = self.game_factory.clients[-1]
+            protocol.dataReceived(base64.b64decode(line[len(HANDOFF) + 1:]))
+            self.handoffs += 1
+            self.send_open()
+
+        def send_open(self):
+            """
+            Reports the player waiting alone in the open room, or else for
+            a journaled partner, along with the number of connections
+            handed off so far.
+            """
+            room = self.game_factory.open_room
+            if room is None or not room.clients:
+                room = next((waiting for waiting, _ in
+                             self.game_factory.waiting.values()), None)
+            name = (room.clients[0].name if room is not None and room.clients
+                    else "")
+            self.sendLine("{0} {1} {2}".format(
+                OPEN, self.handoffs, name).encode("utf-8"))
+
+        def send_closed(self, names):
+            """
+            Reports the names of a closed room unless they can resume it.
+            """
+            factory = self.game_factory
+            for name in names:
+                if (factory.journal is not None and factory.resume_wait > 0
+                        and factory.journal.resume_point(name) is not None):
+                    continue
+                self.sendLine("{0} {1}".format(CLOSED, name).encode("utf-8"))
+
+        def send_stats(self):
+            self.sendLine("{0} {1}".format(
+                STATS, json.dumps(self.game_factory.stats())).encode("utf-8"))
+
+        def connectionLost(self, reason):
+            if self.stats_loop.running:
+                self.stats_loop.stop()
+            if reactor.running:
+                reactor.stop()
+
+    # the front stops the workers by closing the channels
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    session = "{0}-w{1}".format(args.session, index)
+    metrics_port = args.metrics_port + index if args.metrics_port else 0
+    game_factory, logger = build_server(args, session, metrics_port)
+    front = WorkerChannel(game_factory)
+    control = Factory.forProtocol(lambda: front)
+    reactor.adoptStreamConnection(channel.fileno(), socket.AF_UNIX, control)
+    channel.close()
+
+    resume_expired = game_factory.resume_expired
+    close_room = game_factory.close_room
+
+    def report_expired(partner):
+        resume_expired(partner)
+        front.send_open()
+
+    def report_close(room):
+        names = [client.name for client in room.clients]
+        closed = room.id in game_factory.rooms
+        close_room(room)
+        if closed:
+            front.send_closed(names)
+            front.send_open()
+    game_factory.resume_expired = report_expired
+    game_factory.close_room = report_close
+    logger.log_info("Worker {0} started".format(index))
+    reactor.run()
+
+
+class Front(object):
+    """
+    Accepts connections and hands them to workers by player name.
+    """
+
+    def __init__(self, listener, channels, logger, stats_interval,
+                 names=None):
+        """
+        names maps player names to worker indices, e.g. from the journals.
+        """
+        self.listener = listener
+        self.channels = channels
+        self.logger = logger
+        self.stats_interval = stats_interval
+        self.names = dict(names or {})
+        # name waiting for a partner by worker, oldest first, and the
+        # number of connections handed to every worker
+        self.open = {}
+        self.handoffs = [0] * len(channels)
+        self.next_worker = 0
+        # [accept time, bytes read] by connection
+        self.handshakes = {}
+        self.buffers = {channel: b"" for channel in channels}
+        self.worker_stats = {}
+        self.last_report = (time.time(), None)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(listener, selectors.EVENT_READ)
+        for channel in channels:
+            self.selector.register(channel, selectors.EVENT_READ)
+
+    def accept(self):
+        try:
+            connection, _ = self.listener.accept()
+        except BlockingIOError:
+            return
+        connection.setblocking(False)
+        self.handshakes[connection] = [time.time(), b""]
+        self.selector.register(connection, selectors.EVENT_READ)
+
+    def drop(self, connection):
+        self.selector.unregister(connection)
+        del self.handshakes[connection]
+        connection.close()
+
+    def handshake(self, connection):
+        """
+        Reads a connection until its "ready <name>" line, then hands it
+        off.
+        """
+        try:
+            data = connection.recv(MAX_HANDSHAKE)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        data = self.handshakes[connection][1] + data
+        if not data or len(data) > MAX_HANDSHAKE:
+            self.drop(connection)
+            return
+        self.handshakes[connection][1] = data
+        for line in data.split(b"\r\n")[:-1]:
+            if line[:6] == b"ready ":
+                self.handoff(connection, line[6:].decode("utf-8", "replace"))
+                return
+
+    def expire_handshakes(self):
+        """
+        Closes connections which did not report ready in time.
+        """
+        deadline = time.time() - HANDSHAKE_TIMEOUT
+        for connection, (accepted, _) in list(self.handshakes.items()):
+            if accepted < deadline:
+                self.drop(connection)
+
+    def route(self, name):
+        """
+        Returns the worker of a name, pairing other names with the oldest
+        player waiting for a partner, or two by two.
+        """
+        worker = self.names.get(name)
+        if worker is not None:
+            return worker
+        if self.open:
+            worker = next(iter(self.open))
+            del self.open[worker]
+        else:
+            worker = self.next_worker
+            self.next_worker = (worker + 1) % len(self.channels)
+            self.open[worker] = name
+        self.names[name] = worker
+        return worker
+
+    def handoff(self, connection, name):
+        data = self.handshakes[connection][1]
+        self.selector.unregister(connection)
+        del self.handshakes[connection]
+        index = self.route(name)
+        self.handoffs[index] += 1
+        worker = self.channels[index]
+        line = "{0} {1}\r\n".format(
+            HANDOFF, base64.b64encode(data).decode("ascii"))
+        try:
+            socket.send_fds(worker, [line.encode("ascii")],
+                            [connection.fileno()])
+        finally:
+            connection.close()
+
+    def read(self, channel):
+        data = channel.recv(65536)
+        if not data:
+            raise RuntimeError("worker {0} exited".format(
+                self.channels.index(channel)))
+        lines = (self.buffers[channel] + data).split(b"\r\n")
+        self.buffers[channel] = lines.pop()
+        for line in lines:
+            line = line.decode("utf-8")
+            if line[:len(STATS)] == STATS:
+                self.worker_stats[self.channels.index(channel)] = json.loads(
+                    line[len(STATS) + 1:])
+            elif line[:len(OPEN)] == OPEN:
+                # reports sent before the worker adopted every connection
+                # handed to it are outdated
+                worker = self.channels.index(channel)
+                handoffs, name = line[len(OPEN) + 1:].split(" ", 1)
+                if int(handoffs) == self.handoffs[worker]:
+                    self.open.pop(worker, None)
+                    if name:
+                        self.open[worker] = name
+            elif line[:len(CLOSED)] == CLOSED:
+                name = line[len(CLOSED) + 1:]
+                if self.names.get(name) == self.channels.index(channel):
+                    del self.names[name]
+
+    def report_stats(self):
+        now = time.time()
+        totals = rollup(list(self.worker_stats.values()))
+        last_time, last_totals = self.last_report
+        if last_totals is not None:
+            elapsed = max(now - last_time, 1e-6)
+            self.logger.log_info(
+                "workers: {0}, rooms: {1}, clients: {2}, moves/s: {3:.1f}, "
+                "broadcasts/s: {4:.1f}, bytes/s: {5:.0f}".format(
+                    totals["workers"], totals.get("rooms", 0),
+                    totals.get("clients", 0),
+                    *[(totals.get(key, 0) - last_totals.get(key, 0))
+                      / elapsed
+                      for key in ("moves", "broadcasts", "bytes_sent")]))
+        self.last_report = (now, totals)
+
+    def run(self):
+        next_report = time.time() + self.stats_interval
+        while True:
+            timeout = (max(next_report - time.time(), 0)
+                       if self.stats_interval > 0 else None)
+            if self.handshakes:
+                timeout = (HANDSHAKE_TIMEOUT if timeout is None
+                           else min(timeout, HANDSHAKE_TIMEOUT))
+            for key, _ in self.selector.select(timeout):
+                if key.fileobj is self.listener:
+                    self.accept()
+                elif key.fileobj in self.handshakes:
+                    self.handshake(key.fileobj)
+                else:
+                    self.read(key.fileobj)
+            self.expire_handshakes()
+            if self.stats_interval > 0 and time.time() >= next_report:
+                self.report_stats()
+                next_report += self.stats_interval
+
+
+def serve(args):
+    """
+    Starts args.workers workers and runs the front until interrupted.
+    """
+    listener = socket.create_server(("", args.port), backlog=1024)
+    listener.setblocking(False)
+    # spawned workers start with a fresh reactor
+    context = multiprocessing.get_context("spawn")
+    channels = []
+    workers = []
+    for index in range(args.workers):
+        channel, worker_channel = socket.socketpair()
+        worker = context.Process(target=run_worker,
+                                 args=(index, worker_channel,
+                                       listener.family, args),
+                                 name="worker{0}".format(index))
+        worker.start()
+        worker_channel.close()
+        channels.append(channel)
+        workers.append(worker)
+
+    logger = Logger("{0}.txt".format(args.session))
+    logger.log_info("Sharded server started on port {0}, {1} workers".format(
+        args.port, args.workers))
+    names = {}
+    for index in range(args.workers):
+        for name in journal_names("{0}-w{1}.journal".format(args.session,
+                                                           index)):
+            names[name] = index
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit())
+    try:
+        Front(listener, channels, logger, args.stats_interval, names).run()
+    except (KeyboardInterrupt, SystemExit, RuntimeError) as e:
+        logger.log_info("Stopping workers: {0!r}".format(e))
+    finally:
+        listener.close()
+        for channel in channels:
+            channel.close()
+        for worker in workers:
+            worker.join(10)
+        logger.stop()
@@ -6,8 +6,16 @@ Created on Sat Nov 18 16:43:39 2017
 v1.0
 """
 
-import math, random, numpy
+import math, numpy
 import json
+import os, sys
+
+if __name__ == '__main__':
+    # run as a script: the repository root holds the common package
+    sys.path.insert(0, os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from common import shapes
 
 def clip(x, amin, amax):
     if amin > amax:
@@ -19,102 +27,116 @@ def clip(x, amin, amax):
     else:
         return x
 
-def generatePolygon(aveRadius, irregularity, spikeyness, numVerts):
+def generatePolygon(aveRadius, irregularity, spikeyness, numVerts, rng=None):
+    """
+    Generates a single polygon as a list of (x, y) tuples. rng is a numpy
+    Generator or a seed, as for generatePolygons.
+    """
+    return [tuple(p) for p in generatePolygons(
+        1, aveRadius, irregularity, spikeyness, numVerts, rng)[0].tolist()]
+
+
+def generatePolygons(count, aveRadius, irregularity, spikeyness, numVerts,
+                     rng=None):
+    """
+    Generates count random polygons at once as a (count, numVerts, 2) array.
+    rng is a numpy Generator or a seed. Radii above 0.4 are redrawn and
+    polygons with vertices outside [0.1, 0.9] are regenerated, both with
+    vectorized rejection sampling.
+    """
+    rng = numpy.random.default_rng(rng)
     irregularity = clip(irregularity, 0, 1) * 2 * math.pi / numVerts
     spikeyness = clip(spikeyness, 0, 1) * aveRadius
-
-    # generate n angle steps
-    angleSteps = []
     lower = (2 * math.pi / numVerts) - irregularity
     upper = (2 * math.pi / numVerts) + irregularity
-    sum = 0
-    for i in range(numVerts):
-        tmp = random.uniform(lower, upper)
-        angleSteps.append(tmp)
-        sum = sum + tmp
-
-    # normalize the steps so that point 0 and point n+1 are the same
-    k = sum / (2 * math.pi)
-    for i in range(numVerts):
-        angleSteps[i] = angleSteps[i] / k
-
-    # now generate the points
-    points = []
-    angle = random.uniform(0, 2 * math.pi)
-    for i in range(numVerts):
-        r_i = random.gauss(aveRadius, spikeyness)
-        while r_i > 0.4:
-            r_i = random.gauss(aveRadius, spikeyness)
-        x = 0.5 + r_i * math.cos(angle)
-        y = 0.5 + r_i * math.sin(angle)
-        points.append((x, y))
-
-        angle = angle + angleSteps[i]
-        # Input test for verts outside scope.
-
-    if((numpy.array(points) > 0.90).any() or (numpy.array(points) < 0.1).any()):
-        print ("OUT OF SCOPE")
-        return generatePolygon(aveRadius, irregularity, spikeyness, numVerts)
-
-    return points
-
-
-def generatePolygonShapePoints(verts, density):
-    shape_points = []
-
-    for i in range(len(verts)):
 
-        shape_points.append(verts[i])
-        # plt.scatter([p[0] for p in shape_points], [p[1] for p in shape_points])
-        # plt.axis([0, 1, 0, 1])
-        # plt.show()
-
-        x1 = verts[i][0]
-        y1 = verts[i][1]
-
-        if i == (len(verts) - 1):
-            x2 = verts[0][0]
-            y2 = verts[0][1]
-        else:
-            x2 = verts[i + 1][0]
-            y2 = verts[i + 1][1]
-
-            #   print(x1, y1)
-            #   print(x2, y2)
-
-        side_length = (((x1 - x2) ** 2) + ((y1 - y2) ** 2)) ** (1 / 2)
-        split_number = math.floor(side_length / density)
-        if (split_number==0):
-            continue
+    polygons = numpy.empty((count, numVerts, 2))
+    todo = numpy.arange(count)
+    while len(todo) > 0:
+        n = len(todo)
+        # angle steps normalized so that point 0 and point n+1 are the same
+        angleSteps = rng.uniform(lower, upper, (n, numVerts))
+        angleSteps *= 2 * math.pi / angleSteps.sum(axis=1, keepdims=True)
+        angles = rng.uniform(0, 2 * math.pi, (n, 1)) + numpy.cumsum(
+            angleSteps, axis=1) - angleSteps
+
+        radii = rng.normal(aveRadius, spikeyness, (n, numVerts))
+        redraw = radii > 0.4
+        while redraw.any():
+            radii[redraw] = rng.normal(aveRadius, spikeyness, redraw.sum())
+            redraw = radii > 0.4
+
+        points = 0.5 + radii[..., None] * numpy.stack(
+            (numpy.cos(angles), numpy.sin(angles)), axis=-1)
+        inside = ((points >= 0.1) & (points <= 0.9)).all(axis=(1, 2))
+        polygons[todo[inside]] = points[inside]
+        todo = todo[~inside]
+
+    return polygons
+
+
+def _generateChunk(args):
+    count, params, seed = args
+    return generatePolygons(count, rng=numpy.random.default_rng(seed),
+                            **params)
+
+
+def generateLibrary(numRounds, twoPlayer=False, sameShape=True,
+                    processes=None, seed=None, chunkSize=10000, **params):
+    """
+    Generates rounds in the server's shape library format, a list of
+    (shape_a, shape_b, two_player_game). Chunks of chunkSize polygons are
+    generated in parallel processes with independent seeds spawned from
+    seed, so the result does not depend on the number of processes.
+    """
+    count = numRounds * (1 if sameShape else 2)
+    chunks = [min(chunkSize, count - start)
+              for start in range(0, count, chunkSize)]
+    seeds = numpy.random.SeedSequence(seed).spawn(len(chunks))
+    work = [(n, params, s) for n, s in zip(chunks, seeds)]
+    if processes == 1 or len(work) <= 1:
+        results = list(map(_generateChunk, work))
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(processes) as executor:
+            results = list(executor.map(_generateChunk, work))
+    polygons = (numpy.concatenate(results) if results
+                else numpy.empty((0, params["numVerts"], 2))).tolist()
 
-        next_x = x1
-        next_y = y1
+    if sameShape:
+        return [(s, s, twoPlayer) for s in polygons]
+    return [(polygons[2*i], polygons[2*i + 1], twoPlayer)
+            for i in range(numRounds)]
 
-        x_delta = (x2 - x1) / split_number
-        y_delta = (y2 - y1) / split_number
-        for j in range(split_number):
-            next_x = next_x + x_delta
-            next_y = next_y + y_delta
-            next_point = [next_x, next_y]
-            shape_points.append(next_point)
 
-    return shape_points
+def generatePolygonShapePoints(verts, density):
+    return shapes.interpolate_shape(verts, density).tolist()
 
 
 if __name__ == "__main__":
-    shapes = []
-    for _ in range(1):
-        s = generatePolygon(aveRadius=0.6, irregularity=0.5, spikeyness=0.4, numVerts=7)
-        shapes.append((s, s, False))
-    #for _ in range(2):
-    #    s = generatePolygon(aveRadius=0.6, irregularity=0.5, spikeyness=0.4, numVerts=7)
-    #    shapes.append((s, s, True))
-    #for _ in range(2):
-    #     s1 = generatePolygon(aveRadius=0.6, irregularity=0.5, spikeyness=0.4, numVerts=7)
-    #    s2 = generatePolygon(aveRadius=0.6, irregularity=0.5, spikeyness=0.4, numVerts=7)
-    #    shapes.append((s1, s2, True))
-    with open("shape_library.json", "w") as f:
-        json.dump(shapes, f)
+    import argparse
+    parser = argparse.ArgumentParser(description="Generate a shape library")
+    parser.add_argument("-o", "--output", default="shape_library.json")
+    parser.add_argument("--rounds", type=int, default=1)
+    parser.add_argument("--two-player", action="store_true")
+    parser.add_argument("--different-shapes", action="store_true",
+                        help="give both players different shapes")
+    parser.add_argument("--ave-radius", type=float, default=0.6)
+    parser.add_argument("--irregularity", type=float, default=0.5)
+    parser.add_argument("--spikeyness", type=float, default=0.4)
+    parser.add_argument("--num-verts", type=int, default=7)
+    parser.add_argument("--processes", type=int)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    library = generateLibrary(args.rounds, args.two_player,
+                              not args.different_shapes, args.processes,
+                              args.seed, aveRadius=args.ave_radius,
+                              irregularity=args.irregularity,
+                              spikeyness=args.spikeyness,
+                              numVerts=args.num_verts)
+    with open(args.output, "w") as f:
+        f.write(json.dumps(library))
 
 #TESTING
 #verts = generatePolygon(aveRadius=0.3, irregularity=10, spikeyness=1000, numVerts=5)